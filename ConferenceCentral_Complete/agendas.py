@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""agendas.py
+
+Udacity conference server-side Python App Engine conference agendas
+
+Every conference has a ConferenceAgenda child holding the SessionForms of
+all its sessions, already encoded, so that getConferenceSessions is a key
+get and a decode instead of an ancestor query and a copy of each Session.
+The agenda is rebuilt from the sessions in the transaction that adds a
+session, and built on first read for conferences created before agendas
+existed.
+
+"""
+
+from protorpc import protojson
+
+from google.appengine.ext import ndb
+
+from copiers import SESSION_COPIER
+from models import ConferenceAgenda
+from models import Session
+from models import SessionForms
+
+AGENDA_ID = 'agenda'
+
+
+def agendaKey(conf_key):
+    """Return the key of the agenda of a conference."""
+    return ndb.Key(ConferenceAgenda, AGENDA_ID, parent=conf_key)
+
+
+def buildAgenda(conf_key, new_sessions=()):
+    """Return the agenda of a conference, made from its sessions.
+
+    new_sessions are sessions put in the current transaction, which its
+    ancestor query can't see yet.
+    """
+    new_keys = set(session.key for session in new_sessions)
+    sessions = [session for session in Session.query(ancestor=conf_key)
+                if session.key not in new_keys]
+    sessions.extend(new_sessions)
+    forms = SessionForms(items=SESSION_COPIER.copyMany(sessions))
+    return ConferenceAgenda(key=agendaKey(conf_key),
+                            sessionForms=protojson.encode_message(forms))
+
+
+@ndb.transactional()
+def rebuildAgenda(conf_key):
+    """Build and store the agenda of a conference; return it."""
+    agenda = buildAgenda(conf_key)
+    agenda.put()
+    return agenda
+
+
+def getAgenda(conf_key):
+    """Return the stored agenda of a conference, or None."""
+    return agendaKey(conf_key).get()
+
+
+def agendaForms(agenda):
+    """Return the SessionForms of an agenda."""
+    return protojson.decode_message(SessionForms, agenda.sessionForms)
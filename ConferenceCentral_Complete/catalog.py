@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+"""catalog.py
+
+Udacity conference server-side Python App Engine conference catalog
+
+Each instance keeps a compact snapshot of every Conference, indexed on the
+fields conferences are searched by, so that queryConferences can answer
+any combination of filters without a datastore query. The snapshot is
+loaded by the warmup request of the instance; until then, and on
+instances started without one, queries go to the datastore.
+
+The snapshot is refreshed incrementally: when the catalog generation kept
+in memcache moves on, only the conferences modified since the last
+refresh are read again. Only writes to the fields of a Row bump the
+generation, so registrations and seat holds don't cause refreshes. The
+query on lastModified is eventually consistent, so a write may be
+missing from its results for a while. Refreshes carry on, each reading
+back REFRESH_OVERLAP before the previous one started, until one starts
+REFRESH_OVERLAP after the generation moved on. The datastore is read
+outside the lock, and while one request refreshes the snapshot the others
+answer from it as it is.
+
+Seats available are kept in seat shards (see seats.py) rather than on
+Conference, so they are not part of the catalog.
+
+"""
+
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+import threading
+import time
+
+from google.appengine.api import memcache
+
+from models import Conference
+import planner
+
+# inverted indexes: value -> set of websafe keys
+INDEXED_FIELDS = ('city', 'topics', 'month')
+# sorted lists of (value, websafe key)
+SORTED_FIELDS = ('maxAttendees',)
+
+# the catalog stops being used past this many conferences
+MAX_ROWS = 50000
+# allowance for writes that commit after a later write's timestamp, or
+# that take a while to show up in the lastModified index
+REFRESH_OVERLAP = timedelta(seconds=30)
+PAGE_TOKEN_PREFIX = 'catalog:'
+BATCH_SIZE = 500
+MEMCACHE_CATALOG_GENERATION_KEY = 'CONFERENCE_CATALOG_GENERATION'
+
+# sorts after every websafe key
+_HIGH = '\xff'
+
+Row = namedtuple('Row', ('websafeKey', 'name', 'city', 'topics', 'month',
+                         'maxAttendees'))
+
+
+def getGeneration():
+    """Return the current generation of the conference catalog."""
+    generation = memcache.get(MEMCACHE_CATALOG_GENERATION_KEY)
+    if generation is None:
+        # seed a lost counter from the clock so that it can't go back to
+        # a generation an instance has already seen
+        memcache.add(MEMCACHE_CATALOG_GENERATION_KEY, int(time.time() * 1000))
+        generation = memcache.get(MEMCACHE_CATALOG_GENERATION_KEY)
+    return generation
+
+
+def bumpGeneration():
+    """Have every instance refresh its catalog; call once Conferences
+    were created or changed."""
+    memcache.incr(MEMCACHE_CATALOG_GENERATION_KEY,
+                  initial_value=int(time.time() * 1000))
+
+
+def parsePageToken(token):
+    """Return the offset of a catalog page token, or None for other tokens.
+
+    Raises ValueError if the token is a malformed catalog token.
+    """
+    if not token:
+        return 0
+    if not token.startswith(PAGE_TOKEN_PREFIX):
+        return None
+    offset = int(token[len(PAGE_TOKEN_PREFIX):])
+    if offset < 0:
+        raise ValueError('Negative offset in page token: %s' % token)
+    return offset
+
+
+class ConferenceCatalog(object):
+    """ConferenceCatalog -- instance-local snapshot of all Conferences"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+        self.enabled = True
+        # whether a request is reading the datastore for a refresh
+        self._refreshing = False
+
+    def _clear(self):
+        self._rows = {}
+        self._values = dict((field, {}) for field in INDEXED_FIELDS)
+        self._sorted = dict((field, []) for field in SORTED_FIELDS)
+        self._generation = None
+        self._watermark = None
+        # when this instance first saw the current generation, and whether
+        # a refresh has started a whole REFRESH_OVERLAP after that
+        self._generation_seen = None
+        self._settled = False
+
+    def load(self):
+        """Read every Conference into an empty snapshot, as a warmup
+        request does. Returns False if the catalog can't be used."""
+        return self._refresh(getGeneration(), full=True)
+
+    def refresh(self, generation):
+        """Bring a loaded snapshot up to date with the datastore.
+
+        generation is the catalog generation read before calling; nothing
+        is read from the datastore when it hasn't changed since the last
+        refresh. Returns False if the catalog can't be used.
+        """
+        return self._refresh(generation, full=False)
+
+    def _refresh(self, generation, full):
+        with self._lock:
+            if not self.enabled:
+                return False
+            loaded = self._watermark is not None
+            if full == loaded:
+                # requests never pay for a full load; a warmup request
+                # doesn't redo one
+                return loaded
+            if self._refreshing:
+                return loaded
+            if generation is not None and generation == self._generation \
+                    and self._settled:
+                return True
+            self._refreshing = True
+            watermark = self._watermark
+
+        # anything written from now on is picked up by the next refresh
+        started = datetime.utcnow()
+        if full:
+            qry = Conference.query()
+        else:
+            qry = Conference.query(Conference.lastModified > watermark)
+        rows = []
+        try:
+            for conf in qry.iter(batch_size=BATCH_SIZE):
+                rows.append(self._row(conf))
+                if len(rows) > MAX_ROWS:
+                    break
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+        with self._lock:
+            for row in rows:
+                self._upsert(row)
+            if len(self._rows) > MAX_ROWS:
+                self._clear()
+                self.enabled = False
+                return False
+
+            # only move past writes the index has had time to show
+            self._watermark = started - REFRESH_OVERLAP
+            if generation is None or generation != self._generation:
+                self._generation_seen = started
+            self._generation = generation
+            self._settled = (generation is not None and
+                             started - self._generation_seen >= REFRESH_OVERLAP)
+            return True
+
+    @staticmethod
+    def _row(conf):
+        return Row(conf.key.urlsafe(), conf.name, conf.city,
+                   tuple(conf.topics), conf.month, conf.maxAttendees)
+
+    def _upsert(self, row):
+        """Add or replace row in the snapshot and its indexes."""
+        wsck = row.websafeKey
+        old = self._rows.get(wsck)
+        if old:
+            self._unindex(old)
+        self._rows[wsck] = row
+
+        for field in INDEXED_FIELDS:
+            for value in self._listValues(row, field):
+                self._values[field].setdefault(value, set()).add(wsck)
+        for field in SORTED_FIELDS:
+            entries = self._sorted[field]
+            entry = (getattr(row, field), wsck)
+            entries.insert(bisect_left(entries, entry), entry)
+
+    def _unindex(self, row):
+        """Remove row from the indexes."""
+        for field in INDEXED_FIELDS:
+            for value in self._listValues(row, field):
+                wscks = self._values[field][value]
+                wscks.discard(row.websafeKey)
+                if not wscks:
+                    del self._values[field][value]
+        for field in SORTED_FIELDS:
+            entries = self._sorted[field]
+            del entries[bisect_left(entries, (getattr(row, field), row.websafeKey))]
+
+    @staticmethod
+    def _listValues(row, field):
+        value = getattr(row, field)
+        return value if isinstance(value, tuple) else (value,)
+
+    def _match(self, filtr):
+        """Return the set of websafe keys matching a single filter."""
+        field, op, value = filtr['field'], filtr['operator'], filtr['value']
+
+        if field in self._values:
+            index = self._values[field]
+            if op == '=':
+                return set(index.get(value, ()))
+            # few distinct values, so compare each of them; a repeated
+            # property matches when any one of its values does
+            compare = planner.comparator(op)
+            matched = set()
+            for v, wscks in index.iteritems():
+                if compare(v, value):
+                    matched |= wscks
+            return matched
+
+        if field in self._sorted:
+            entries = self._sorted[field]
+            low = bisect_left(entries, (value,))
+            high = bisect_left(entries, (value, _HIGH))
+            if op == '!=':
+                return set(wsck for _, wsck in entries[:low] + entries[high:])
+            # missing values sort first and only match '!='
+            first = bisect_left(entries, (None, _HIGH))
+            start, end = {
+                '=': (low, high),
+                '>': (high, len(entries)),
+                '>=': (low, len(entries)),
+                '<': (first, low),
+                '<=': (first, high),
+            }[op]
+            return set(wsck for _, wsck in entries[start:end])
+
+        plan = planner.QueryPlan(None, None, [filtr])
+        return set(wsck for wsck, row in self._rows.iteritems()
+                   if plan.matches(row))
+
+    def query(self, filters, page_size, offset=0):
+        """Return a page of websafe keys matching filters, and the next token.
+
+        Results are in the order the datastore would return them: on the
+        inequality queryConferences would push down, if any, then on name.
+        """
+        with self._lock:
+            if filters:
+                matches = sorted((self._match(f) for f in filters), key=len)
+                wscks = matches[0].intersection(*matches[1:])
+            else:
+                wscks = self._rows.keys()
+            rows = [self._rows[wsck] for wsck in wscks]
+
+        inequality_field = planner.pickInequality(filters)
+        if inequality_field:
+            def sortKey(row):
+                value = getattr(row, inequality_field)
+                # the datastore sorts a repeated property on its lowest value
+                if isinstance(value, tuple):
+                    value = min(value) if value else None
+                return (value, row.name)
+        else:
+            sortKey = lambda row: row.name
+        rows.sort(key=sortKey)
+
+        page = rows[offset:offset + page_size]
+        next_token = None
+        if offset + page_size < len(rows):
+            next_token = PAGE_TOKEN_PREFIX + str(offset + page_size)
+        return [row.websafeKey for row in page], next_token
+
+
+CATALOG = ConferenceCatalog()
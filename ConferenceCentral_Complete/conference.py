@@ -14,35 +14,59 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
+from datetime import timedelta
+import hashlib
+import random
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
+from models import ProfileMiniForms
+from models import ProfileCacheStatsForm
 from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceCreateResultForm
+from models import ConferenceCreateResultForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import FacetCountForm
+from models import FacetForm
+from models import FacetForms
 from models import TeeShirtSize
+from models import Registration
+from models import SeatHold
+from models import SeatHoldForm
+from models import SeatShard
+from models import WaitlistEntry
 from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SessionQueryDurationForm
+from models import SessionWindowForm
+from models import DurationBucketForm
+from models import DurationHistogramForm
+from models import SessionQueryForms
+from models import SearchForm
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerSession
 from models import SpeakerQueryOrganizationForm
 
 from settings import WEB_CLIENT_ID
@@ -52,6 +76,21 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+from catalog import CATALOG
+from copiers import CONFERENCE_COPIER
+from copiers import PROFILE_COPIER
+from copiers import PROFILE_MINI_COPIER
+from copiers import SESSION_COPIER
+from copiers import SPEAKER_COPIER
+import agendas
+import catalog
+import etags
+import facets
+import planner
+import profiles
+import seats
+import textsearch
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
@@ -60,6 +99,24 @@ ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
 FEATURED_SPEAKER_TPL = ('The Featured Speaker is %s, who is giving the '
                         'following sessions: %s.')
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MEMCACHE_QUERY_GENERATION_KEY = "CONFERENCE_QUERY_GENERATION"
+MEMCACHE_QUERY_RESULT_TPL = "CONFERENCE_QUERY:%s:%s"
+QUERY_CACHE_TIME = 10 * 60  # seconds
+ORGANIZER_UPDATE_BATCH_SIZE = 100
+REGISTRATION_MIGRATION_BATCH_SIZE = 100
+# Speakers moved to SpeakerSessions per task, see _migrateSpeakers()
+SPEAKER_MIGRATION_BATCH_SIZE = 100
+# Sessions resaved per task, see _migrateSessionTimes()
+SESSION_MIGRATION_BATCH_SIZE = 100
+SEAT_HOLD_TIME = timedelta(minutes=10)
+HOLD_RELEASE_BATCH_SIZE = 500
+WAITLIST_PROMOTION_BATCH_SIZE = 50
+# most conferences created by one createConferences call
+MAX_BATCH_SIZE = 100
+# most sessions created by one createSessions call
+MAX_SESSION_BATCH_SIZE = 500
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -85,6 +142,23 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+SESSION_FIELDS = {
+            'TYPE': 'typeOfSession',
+            'SPEAKER': 'speakerWebSafeKeys',
+            'DURATION': 'duration',
+            'DATE': 'date',
+            'START_TIME': 'startTime',
+            }
+
+# converters from the filter value strings to the property types
+FIELD_TYPES = {
+            'month': int,
+            'maxAttendees': int,
+            'duration': int,
+            'date': lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            'startTime': lambda value: datetime.strptime(value, "%H:%M").time(),
+            }
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -95,8 +169,25 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+HOLD_POST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeHoldKey=messages.StringField(1),
+)
+
 SESSION_GET_REQUEST = CONF_GET_REQUEST
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESSION_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -106,6 +197,9 @@ SESSION_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
 SESSION_BY_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSpeakerKey=messages.StringField(1),
+    websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
 )
 
 UPDATE_WISHLIST_REQUEST = endpoints.ResourceContainer(
@@ -122,6 +216,11 @@ UPDATE_WISHLIST_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    def __init__(self):
+        super(ConferenceApi, self).__init__()
+        # Profiles read during this request, by user id
+        self._profileMemo = {}
+
 
     def _checkEntityExists(self, websafe_key, entity_kind):
         """Checks that an entity exists and returns it if it does."""
@@ -154,41 +253,76 @@ class ConferenceApi(remote.Service):
         return entity
 
 
+    def _getKeyIfValid(self, websafe_key):
+        """Return the key for websafe_key, or None if it isn't a valid key."""
+        try:
+            return ndb.Key(urlsafe=websafe_key)
+        except Exception:
+            return None
+
+
+    def _getIfNoneMatch(self):
+        """Return the If-None-Match header of the request, if any."""
+        headers = getattr(self.request_state, 'headers', None)
+        return headers.get('If-None-Match') if headers else None
+
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return self._copyConferencesToForms([conf])[0]
 
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _copyConferencesToForms(self, confs):
+        """Copy Conferences to ConferenceForms, skipping missing ones.
+
+        The seats available are summed from the seat shards of all the
+        conferences, read together.
+        """
+        confs = [conf for conf in confs if conf is not None]
+        forms = CONFERENCE_COPIER.copyMany(confs)
+        for cf, seats_available in zip(forms, seats.getSeatsAvailable(confs)):
+            cf.seatsAvailable = seats_available
+
+        # conferences created before organizerDisplayName was stored, until
+        # _migrateOrganizerNames() has run: name them from the Profiles
+        unnamed = [(cf, conf.key.parent()) for cf, conf in zip(forms, confs)
+                   if not conf.organizerDisplayName and conf.key.parent()]
+        if unnamed:
+            p_keys = list(set(p_key for _, p_key in unnamed))
+            names = dict((p_key, prof.displayName) for p_key, prof in
+                         zip(p_keys, ndb.get_multi(p_keys)) if prof)
+            for cf, p_key in unnamed:
+                cf.organizerDisplayName = names.get(p_key)
+        return forms
+
+
+    @ndb.tasklet
+    def _queryConferenceFormsAsync(self, qry, page_size=None, cursor=None,
+                                   predicate=None):
+        """Run a Conference query once and copy the results to ConferenceForms.
+
+        Returns a future for a (forms, next_cursor, more) tuple; without a
+        page_size the whole query is read and no cursor is produced.
+        """
+        confs, next_cursor, more = yield planner.fetchPageAsync(
+            qry, page_size, cursor, predicate=predicate)
+        raise ndb.Return(
+            (self._copyConferencesToForms(confs),
+             next_cursor, more))
+
 
+    def _conferenceDataFromForm(self, request):
+        """Validate a ConferenceForm and return the new Conference's fields."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -197,36 +331,121 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Conference dates must be given as YYYY-MM-DD")
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        return data
+
+
+    def _putConferences(self, user, user_id, forms_data):
+        """Create the Conferences of one organizer from (form, data) pairs.
+
+        Ids are allocated in a single range, the Conferences written with
+        one put_multi and the follow-up tasks queued together, with a
+        single confirmation email for all of them.
+        """
         # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # IDs based on Profile key
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
+        first_id, _ = Conference.allocate_ids(size=len(forms_data), parent=p_key)
+
+        # keep the organizer's name with the conference so listings don't
+        # need to look up their Profile; a new Profile is named after the
+        # user's nickname, see _getProfileFromUser()
+        prof = p_key.get()
+        display_name = getattr(prof, 'displayName', None) or user.nickname()
+
+        confs = []
+        for c_id, (form, data) in enumerate(forms_data, first_id):
+            data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+            form.websafeKey = data['key'].urlsafe()
+            data['organizerUserId'] = form.organizerUserId = user_id
+            data['organizerDisplayName'] = form.organizerDisplayName = \
+                display_name
+            confs.append(Conference(**data))
+        ndb.put_multi(confs + [shard for conf in confs
+                               for shard in seats.createShards(
+                                   conf.key, conf.seatsAvailable)])
+        self._bumpQueryGeneration()
+        catalog.bumpGeneration()
+
+        # one update of the facet counts for all the new conferences
+        new_values = {}
+        for conf in confs:
+            for field, values in facets.facetValues(conf).iteritems():
+                new_values.setdefault(field, []).extend(values)
+
+        tasks = [taskqueue.Task(params={'websafeKey': conf.key.urlsafe()},
+                                url='/tasks/index_document') for conf in confs]
+        tasks.append(taskqueue.Task(params={'deltas': facets.encodeDeltas(
+            facets.countDeltas(new_values=new_values))},
+            url='/tasks/update_facets'))
+        tasks.append(taskqueue.Task(params={'email': user.email(),
+            'conferenceInfo': '\r\n\r\n'.join(
+                repr(form) for form, _ in forms_data)},
+            url='/tasks/send_confirmation_email'))
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        return confs
+
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        data = self._conferenceDataFromForm(request)
+        self._putConferences(user, user_id, [(request, data)])
         return request
 
 
-    @ndb.transactional()
+    def _createConferenceObjects(self, request):
+        """Create Conferences from ConferenceForms, reporting per-item errors."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        if len(request.items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                'At most %d conferences can be created at once' % MAX_BATCH_SIZE)
+
+        # an invalid form is reported in its result and doesn't stop the others
+        results = []
+        forms_data = []
+        for index, form in enumerate(request.items):
+            result = ConferenceCreateResultForm(index=index)
+            try:
+                forms_data.append((form, self._conferenceDataFromForm(form)))
+                result.conference = form
+            except endpoints.BadRequestException, e:
+                result.error = str(e)
+            results.append(result)
+
+        if forms_data:
+            self._putConferences(user, user_id, forms_data)
+        return ConferenceCreateResultForms(items=results)
+
+
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -244,9 +463,16 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        old_facet_values = facets.facetValues(conf)
+        old_max_attendees = conf.maxAttendees or 0
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # the organizer fields, seats and etag are maintained by the server
+            if field.name in ('organizerUserId', 'organizerDisplayName',
+                              'seatsAvailable', 'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -257,9 +483,27 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # seats follow a change of maxAttendees, spread over the seat shards
+        if (conf.maxAttendees or 0) != old_max_attendees:
+            conf.seatsAvailable = seats.rebalance(
+                conf, (conf.maxAttendees or 0) - old_max_attendees)
+            if (conf.maxAttendees or 0) > old_max_attendees:
+                self._queueWaitlistPromotion(conf.key, transactional=True)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # cached query results are only invalidated once the update commits
+        ndb.get_context().call_on_commit(self._bumpQueryGeneration)
+        ndb.get_context().call_on_commit(catalog.bumpGeneration)
+        taskqueue.add(params={'websafeKey': conf.key.urlsafe()},
+            url='/tasks/index_document', transactional=True
+        )
+        facet_deltas = facets.countDeltas(old_facet_values,
+                                          facets.facetValues(conf))
+        if facet_deltas:
+            taskqueue.add(params={'deltas': facets.encodeDeltas(facet_deltas)},
+                url='/tasks/update_facets', transactional=True
+            )
+        return self._copyConferenceToForm(conf)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -269,6 +513,14 @@ class ConferenceApi(remote.Service):
         return self._createConferenceObject(request)
 
 
+    @endpoints.method(ConferenceForms, ConferenceCreateResultForms,
+            path='conferences', http_method='POST',
+            name='createConferences')
+    def createConferences(self, request):
+        """Create several new conferences at once."""
+        return self._createConferenceObjects(request)
+
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
@@ -282,13 +534,26 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        # answer a conditional request from the cached ETag alone
+        if_none_match = self._getIfNoneMatch()
+        conf_key = self._getKeyIfValid(request.websafeConferenceKey)
+        cached_etag = etags.getConferenceEtag(conf_key) \
+            if if_none_match and conf_key else None
+        if etags.matchesEtag(if_none_match, cached_etag):
+            return ConferenceForm(etag=cached_etag, notModified=True)
+
         # get Conference object from request; bail if not found
         conf = self._checkEntityExists(request.websafeConferenceKey, 'conference')
+        cf = self._copyConferenceToForm(conf)
+
+        # registrations change the seats available but not the Conference
+        cf.etag = etags.makeEtag(conf.version, cf.seatsAvailable)
+        etags.cacheConferenceEtag(conf.key, cf.etag)
+        if etags.matchesEtag(if_none_match, cf.etag):
+            return ConferenceForm(etag=cf.etag, notModified=True)
 
-        # Get profile of creator in order to return their name
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -304,59 +569,120 @@ class ConferenceApi(remote.Service):
 
         # create ancestor query for all key matches for this user
         confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        forms, _, _ = self._queryConferenceFormsAsync(confs).get_result()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        return ConferenceForms(items=forms)
 
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+        """Return a query plan for the submitted filters.
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        The datastore query sorts on the pushed down inequality, if any, and
+        then on name; the other inequality filters are left to plan.matches.
+        """
+        filters = self._formatFilters(request.filters)
+        return planner.planQuery(Conference, filters, order='name')
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
 
+    def _formatFilters(self, filters, fields=FIELDS):
+        """Parse, check validity and format user supplied filters.
 
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        Values are coerced to the type of their property and the filters are
+        returned sorted, so equivalent requests produce the same filter list.
+        """
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
 
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
+                filtr["field"] = fields[filtr["field"]]
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in FIELD_TYPES:
+                try:
+                    filtr["value"] = FIELD_TYPES[filtr["field"]](filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on '%s' has an invalid value: %s" %
+                        (filtr["field"], filtr["value"]))
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+
+        formatted_filters.sort(
+            key=lambda f: (f["field"], f["operator"], f["value"]))
+        return formatted_filters
+
+
+    @staticmethod
+    def _getQueryGeneration():
+        """Return the current generation of cached conference queries."""
+        generation = memcache.get(MEMCACHE_QUERY_GENERATION_KEY)
+        if generation is None:
+            # seed a lost counter from the clock so that it can't go back
+            # to a generation whose results may still be cached
+            memcache.add(MEMCACHE_QUERY_GENERATION_KEY, int(time.time() * 1000))
+            generation = memcache.get(MEMCACHE_QUERY_GENERATION_KEY)
+        return generation
+
+
+    @staticmethod
+    def _bumpQueryGeneration():
+        """Invalidate all cached conference queries."""
+        memcache.incr(MEMCACHE_QUERY_GENERATION_KEY,
+                      initial_value=int(time.time() * 1000))
+
+
+    def _getQueryCacheKey(self, filters, page_size, page_token):
+        """Return the memcache key of a page of conference query results.
+
+        Returns None when the query generation is unavailable, in which
+        case results must not be cached.
+        """
+        generation = self._getQueryGeneration()
+        if generation is None:
+            return None
+        canonical = repr((
+            [(f["field"], f["operator"], f["value"]) for f in filters],
+            page_size, page_token))
+        return MEMCACHE_QUERY_RESULT_TPL % (
+            generation, hashlib.sha1(canonical).hexdigest())
+
+
+    def _getPageSize(self, request):
+        """Return the page size requested by the client."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        return min(page_size, MAX_PAGE_SIZE)
+
+
+    def _getCursor(self, page_token):
+        """Return the datastore cursor a page token stands for."""
+        # the page token is the websafe form of a datastore cursor
+        if not page_token:
+            return None
+        try:
+            return Cursor(urlsafe=page_token)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException(
+                'Invalid page token: %s' % page_token)
+
+
+    def _getPageParams(self, request):
+        """Return the page size and start cursor requested by the client."""
+        return self._getPageSize(request), self._getCursor(request.pageToken)
+
+
+    def _getConferenceFormsByKeys(self, wsck_list, next_token):
+        """Return ConferenceForms for a page of conference websafe keys."""
+        confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wsck_list])
+        return ConferenceForms(
+            items=self._copyConferencesToForms(confs),
+            nextPageToken=next_token
+        )
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -364,40 +690,97 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        page_size = self._getPageSize(request)
+        filters = self._formatFilters(request.filters)
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        # answer from this instance's conference catalog when it is usable;
+        # a page token from a datastore query carries on with the datastore
+        try:
+            offset = catalog.parsePageToken(request.pageToken)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Invalid page token: %s' % request.pageToken)
+        if offset is not None:
+            if CATALOG.refresh(catalog.getGeneration()):
+                return self._getConferenceFormsByKeys(
+                    *CATALOG.query(filters, page_size, offset))
+            if request.pageToken:
+                raise endpoints.BadRequestException(
+                    'Page token has expired: %s' % request.pageToken)
+        cursor = self._getCursor(request.pageToken)
+
+        # serve the page from the ordered list of keys cached for this
+        # combination of filters, if there is one
+        cache_key = self._getQueryCacheKey(filters, page_size, request.pageToken)
+        cached = memcache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return self._getConferenceFormsByKeys(*cached)
+
+        # only fetch a single page of conferences, resuming from the cursor
+        plan = self._getQuery(request)
+        forms, next_cursor, more = self._queryConferenceFormsAsync(
+            plan.query, page_size, cursor, plan.matches).get_result()
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        if cache_key:
+            memcache.set(cache_key,
+                         ([cf.websafeKey for cf in forms], next_token),
+                         time=QUERY_CACHE_TIME)
+
+        # return individual ConferenceForm object per Conference, along
+        # with a token for the next page if there are more results
+        return ConferenceForms(items=forms, nextPageToken=next_token)
+
+
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+            path='conferenceFacets',
+            http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences per city, topic and month."""
+        counts = facets.getCounts()
+        # report fields by the names queryConferences filters use
+        filter_names = dict((field, name) for name, field in FIELDS.iteritems())
+
+        return FacetForms(items=[
+            FacetForm(field=filter_names[field], counts=[
+                FacetCountForm(value=value, count=count) for value, count in
+                sorted(counts[field].iteritems(), key=lambda vc: (-vc[1], vc[0]))
+            ]) for field in facets.FACET_FIELDS
+        ])
+
+
+    def _getSearchOffset(self, page_token):
+        """Return the result offset a search page token stands for."""
+        try:
+            offset = int(page_token or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException(
+                'Invalid page token: %s' % page_token)
+        return offset
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+    @endpoints.method(SearchForm, ConferenceForms,
+            path='searchConferences',
+            http_method='POST',
+            name='searchConferences')
+    def searchConferences(self, request):
+        """Search conference names and descriptions, best matches first."""
+        keys, next_offset = textsearch.search(
+            'Conference', request.query, self._getPageSize(request),
+            self._getSearchOffset(request.pageToken))
+        return self._getConferenceFormsByKeys(
+            [key.urlsafe() for key in keys],
+            str(next_offset) if next_offset is not None else None)
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        pf = PROFILE_COPIER.copy(prof)
+        pf.conferenceKeysToAttend = self._getRegisteredConferenceKeys(prof)
         return pf
 
 
@@ -408,14 +791,13 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # get Profile from datastore
+        # get Profile from the cache or datastore
         user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = profiles.getProfile(user_id, self._profileMemo)
         # create new Profile if not there
         if not profile:
             profile = Profile(
-                key = p_key,
+                key = ndb.Key(Profile, user_id),
                 displayName = user.nickname(),
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
@@ -429,6 +811,7 @@ class ConferenceApi(remote.Service):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
         prof = self._getProfileFromUser()
+        display_name = prof.displayName
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
@@ -442,11 +825,74 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
                         prof.put()
+            profiles.invalidate(prof.key.id(), self._profileMemo)
+
+            # copy a new name to the conferences this user organizes
+            if prof.displayName != display_name:
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name'
+                )
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id, websafe_cursor=None):
+        """Copy an organizer's display name to a batch of their conferences.
+
+        Queues a task for the next batch until all conferences are updated.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return
+
+        cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+        confs, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            ORGANIZER_UPDATE_BATCH_SIZE, start_cursor=cursor)
+
+        # the current name is read by every batch, so a later rename
+        # simply wins over this one
+        stale = [conf for conf in confs
+                 if conf.organizerDisplayName != prof.displayName]
+        for conf in stale:
+            conf.organizerDisplayName = prof.displayName
+        ndb.put_multi(stale)
+
+        if more and next_cursor:
+            taskqueue.add(params={'userId': user_id,
+                'cursor': next_cursor.urlsafe()},
+                url='/tasks/update_organizer_name'
+            )
+
+
+    @staticmethod
+    def _migrateOrganizerNames(websafe_cursor=None):
+        """Store the organizer's display name on a batch of Conferences.
+
+        Queues a task for the next batch until all Conferences have one.
+        """
+        cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+        confs, next_cursor, more = Conference.query().fetch_page(
+            ORGANIZER_UPDATE_BATCH_SIZE, start_cursor=cursor)
+
+        unnamed = [conf for conf in confs
+                   if not conf.organizerDisplayName and conf.key.parent()]
+        profs = ndb.get_multi([conf.key.parent() for conf in unnamed])
+        named = []
+        for conf, prof in zip(unnamed, profs):
+            if prof and prof.displayName:
+                conf.organizerDisplayName = prof.displayName
+                named.append(conf)
+        ndb.put_multi(named)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_organizer_names'
+            )
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
@@ -461,6 +907,14 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+    @endpoints.method(message_types.VoidMessage, ProfileCacheStatsForm,
+            path='profile/cacheStats', http_method='GET',
+            name='getProfileCacheStats')
+    def getProfileCacheStats(self, request):
+        """Return the hit and miss counts of the Profile cache."""
+        return ProfileCacheStatsForm(**profiles.getStats())
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
@@ -468,10 +922,22 @@ class ConferenceApi(remote.Service):
         """Create Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
-        confs = Conference.query(ndb.AND(
+        # a conference with 1 to 5 seats left has a shard holding 1 to 5;
+        # conferences without shards yet still keep their count on the
+        # Conference
+        conf_keys = set(shard.conference for shard in SeatShard.query(ndb.AND(
+            SeatShard.seats <= 5,
+            SeatShard.seats > 0)
+        ).fetch(projection=[SeatShard.conference]))
+        conf_keys.update(Conference.query(ndb.AND(
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        ).fetch(keys_only=True))
+
+        candidates = [conf for conf in ndb.get_multi(list(conf_keys)) if conf]
+        confs = [conf for conf, seats_available in
+                 zip(candidates, seats.getSeatsAvailable(candidates))
+                 if 0 < seats_available <= 5]
 
         if confs:
             # If there are almost sold out conferences,
@@ -498,49 +964,151 @@ class ConferenceApi(remote.Service):
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _registrationKey(p_key, wsck):
+        """Return the key of the Registration of a Profile for a Conference."""
+        return ndb.Key(Registration, wsck, parent=p_key)
+
+
+    def _getRegisteredConferenceKeys(self, prof):
+        """Return the websafe keys of the conferences prof is registered for."""
+        wscks = [reg_key.id() for reg_key in
+                 Registration.query(ancestor=prof.key).fetch(keys_only=True)]
+        # registrations not migrated yet, see _migrateRegistrations()
+        wscks.extend(wsck for wsck in prof.conferenceKeysToAttend
+                     if wsck not in wscks)
+        return wscks
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateProfileRegistrations(p_key):
+        """Move the registrations listed in a Profile to Registrations."""
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return
+        regs = [Registration(key=ConferenceApi._registrationKey(p_key, wsck),
+                             conference=ndb.Key(urlsafe=wsck))
+                for wsck in set(prof.conferenceKeysToAttend)]
+        prof.conferenceKeysToAttend = []
+        ndb.put_multi(regs + [prof])
+        profiles.invalidate(p_key.id())
+
+
+    @staticmethod
+    def _migrateRegistrations(websafe_cursor=None):
+        """Migrate the registrations of a batch of Profiles.
+
+        Queues a task for the next batch until all Profiles are migrated.
+        """
+        cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+        profs, next_cursor, more = Profile.query().fetch_page(
+            REGISTRATION_MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        # each Profile and its Registrations are one entity group
+        for prof in profs:
+            if prof.conferenceKeysToAttend:
+                ConferenceApi._migrateProfileRegistrations(prof.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_registrations'
+            )
+
+
+    @ndb.transactional(xg=True)
+    def _registerWithShard(self, wsck, shard_key):
+        """Take a seat from one seat shard and register the user.
+
+        Returns False if the shard has run out of seats.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        reg_key = self._registrationKey(prof.key, wsck)
+
+        # check if user already registered otherwise add
+        if wsck in prof.conferenceKeysToAttend or reg_key.get():
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # check if seats avail
+        shard = shard_key.get()
+        if not shard or shard.seats <= 0:
+            return False
+
+        # register user, take away one seat
+        shard.seats -= 1
+        ndb.put_multi([Registration(key=reg_key,
+                                    conference=ndb.Key(urlsafe=wsck)),
+                       shard])
+        return True
+
+
     @ndb.transactional(xg=True)
+    def _unregisterWithShard(self, wsck, shard_key):
+        """Unregister the user, giving their seat back to one seat shard.
+
+        Returns False if the user wasn't registered.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        reg_key = self._registrationKey(prof.key, wsck)
+
+        # check if user already registered; profiles that haven't been
+        # migrated yet keep their registrations in a list
+        shard = shard_key.get()
+        if reg_key.get():
+            reg_key.delete()
+        elif wsck in prof.conferenceKeysToAttend:
+            prof.conferenceKeysToAttend.remove(wsck)
+            prof.put()
+        else:
+            return False
+
+        # unregister user, add back one seat
+        shard.seats += 1
+        shard.put()
+        return True
+
+
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        retval = None
+        """Register or unregister user for selected conference.
+
+        Each transaction only involves the user's Profile and one of the
+        conference's seat shards, so concurrent registrations for the same
+        conference don't contend on the Conference entity.
+        """
+        # the transactions read the Profile again; this makes sure it exists
         prof = self._getProfileFromUser() # get user Profile
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = self._checkEntityExists(wsck, 'conference')
+        conf = self._checkEntityExists(request.websafeConferenceKey,
+                                       'conference')
+        wsck = conf.key.urlsafe()
+        shards = seats.loadShards(conf)
 
-        # register
+        # register, trying the shards with seats left in random order
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            for shard_key in seats.candidateShardKeys(shards):
+                if self._registerWithShard(wsck, shard_key):
+                    retval = True
+                    break
+            else:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
-        # unregister
+        # unregister, handing the seat on to the waitlist
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+            retval = self._unregisterWithShard(
+                wsck, random.choice(shards).key)
+            if retval:
+                self._queueWaitlistPromotion(conf.key)
+
+        # cached query results and the conference's ETag hold the seats,
+        # and the cached Profile may hold the registration
+        if retval:
+            self._bumpQueryGeneration()
+            etags.conferenceWritten(conf.key)
+            profiles.invalidate(prof.key.id(), self._profileMemo)
         return BooleanMessage(data=retval)
 
 
@@ -550,22 +1118,292 @@ class ConferenceApi(remote.Service):
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+        conf_keys = [ndb.Key(urlsafe=wsck)
+                     for wsck in self._getRegisteredConferenceKeys(prof)]
         conferences = ndb.get_multi(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        # return set of ConferenceForm objects per Conference
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences)
+        )
+
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+# - - - Waitlist - - - - - - - - - - - - - - - - - - - - - -
 
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+    @staticmethod
+    def _queueWaitlistPromotion(conf_key, transactional=False):
+        """Queue a task registering waiters for the seats left, if any."""
+        taskqueue.add(params={'websafeConferenceKey': conf_key.urlsafe()},
+            url='/tasks/promote_waitlist', transactional=transactional
+        )
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _reserveSeatsForWaiters(conf_key):
+        """Take seats for the first batch of waiters of a conference.
+
+        Their waitlist entries are removed in the same transaction, which
+        queues the task registering them. Returns the number of waiters
+        promoted.
+        """
+        shards = [shard for shard in ndb.get_multi(seats.shardKeys(conf_key))
+                  if shard]
+        available = sum(shard.seats for shard in shards)
+        if available <= 0:
+            return 0
+        entries = WaitlistEntry.query(ancestor=conf_key).order(
+            WaitlistEntry.created).fetch(
+                min(available, WAITLIST_PROMOTION_BATCH_SIZE))
+        if not entries:
+            return 0
+
+        ndb.put_multi(seats.takeSeats(shards, len(entries)))
+        ndb.delete_multi([entry.key for entry in entries])
+        taskqueue.add(params={'websafeConferenceKey': conf_key.urlsafe(),
+            'userId': [entry.key.id() for entry in entries]},
+            url='/tasks/register_waiters', transactional=True
         )
+        return len(entries)
+
+
+    @staticmethod
+    def _promoteWaitlist(wsck):
+        """Promote a batch of waiters to the seats left at a conference.
+
+        Queues a task for the next batch while there may be more.
+        """
+        conf_key = ndb.Key(urlsafe=wsck)
+        promoted = ConferenceApi._reserveSeatsForWaiters(conf_key)
+        if promoted:
+            ConferenceApi._bumpQueryGeneration()
+            etags.conferenceWritten(conf_key)
+        if promoted == WAITLIST_PROMOTION_BATCH_SIZE:
+            ConferenceApi._queueWaitlistPromotion(conf_key)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _registerWaiter(conf_key, reg_key):
+        """Register a promoted waiter, whose seat has already been taken.
+
+        Returns True if the waiter had registered by themselves in the
+        meantime, which already took them a seat; the seat taken for them
+        is given back.
+        """
+        reg = reg_key.get()
+        if not reg:
+            Registration(key=reg_key, conference=conf_key,
+                         fromWaitlist=True).put()
+            return False
+        if reg.fromWaitlist:
+            # registered by an earlier run of the task
+            return False
+        # marked so that a rerun of the task doesn't give back another seat
+        reg.fromWaitlist = True
+        reg.put()
+        seats.returnSeats(conf_key, 1)
+        return True
+
+
+    @staticmethod
+    def _registerWaiters(wsck, user_ids):
+        """Register promoted waiters, whose seats have already been taken."""
+        conf_key = ndb.Key(urlsafe=wsck)
+        # one transaction per waiter, as each Profile is an entity group
+        extra_seats = 0
+        for user_id in user_ids:
+            reg_key = ConferenceApi._registrationKey(
+                ndb.Key(Profile, user_id), wsck)
+            if ConferenceApi._registerWaiter(conf_key, reg_key):
+                extra_seats += 1
+        if extra_seats:
+            # cached query results and the conference's ETag hold the seats
+            ConferenceApi._bumpQueryGeneration()
+            etags.conferenceWritten(conf_key)
+            ConferenceApi._queueWaitlistPromotion(conf_key)
+
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='POST', name='joinWaitlist')
+    def joinWaitlist(self, request):
+        """Join the waitlist of a sold out conference.
+
+        Waiters are registered in the order they joined as seats free up.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        conf = self._checkEntityExists(request.websafeConferenceKey,
+                                       'conference')
+        wsck = conf.key.urlsafe()
+        if wsck in prof.conferenceKeysToAttend or \
+                self._registrationKey(prof.key, wsck).get():
+            raise ConflictException(
+                "You have already registered for this conference")
+        if seats.getSeatsAvailable([conf])[0] > 0:
+            raise ConflictException(
+                "There are seats available; register instead.")
+
+        WaitlistEntry.get_or_insert(prof.key.id(), parent=conf.key)
+
+        # seats freed up since the check may have found the waitlist empty
+        if seats.getSeatsAvailable([conf])[0] > 0:
+            self._queueWaitlistPromotion(conf.key)
+        return BooleanMessage(data=True)
+
+
+# - - - Seat holds - - - - - - - - - - - - - - - - - - - - -
+
+    @ndb.transactional()
+    def _holdWithShard(self, conf_key, shard_key, user_id):
+        """Take a seat from one seat shard into a hold for the user.
+
+        The hold is a child of the shard, so this is a single entity group
+        transaction. Returns the SeatHold, or None if the shard has run
+        out of seats.
+        """
+        shard = shard_key.get()
+        if not shard or shard.seats <= 0:
+            return None
+        shard.seats -= 1
+        hold = SeatHold(key=ndb.Key(SeatHold, user_id, parent=shard_key),
+                        conference=conf_key,
+                        expires=datetime.utcnow() + SEAT_HOLD_TIME)
+        ndb.put_multi([shard, hold])
+        return hold
+
+
+    @ndb.transactional()
+    def _extendHold(self, hold_key):
+        """Restart the hold time of a seat hold, if it hasn't been released."""
+        hold = hold_key.get()
+        if hold:
+            hold.expires = datetime.utcnow() + SEAT_HOLD_TIME
+            hold.put()
+        return hold
+
+
+    @ndb.transactional(xg=True)
+    def _confirmHold(self, hold_key):
+        """Turn the user's seat hold into a Registration."""
+        prof = self._getProfileFromUser() # get user Profile
+        hold = hold_key.get()
+        if not hold or hold_key.id() != prof.key.id():
+            raise endpoints.NotFoundException(
+                'No seat hold found with key: %s' % hold_key.urlsafe())
+        if hold.expires < datetime.utcnow():
+            raise ConflictException(
+                "The seat hold has expired")
+
+        wsck = hold.conference.urlsafe()
+        reg_key = self._registrationKey(prof.key, wsck)
+        if wsck in prof.conferenceKeysToAttend or reg_key.get():
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # the seat was taken from its shard by holdSeat
+        Registration(key=reg_key, conference=hold.conference).put()
+        hold_key.delete()
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _releaseHolds(shard_key, hold_keys):
+        """Give the seats of the expired holds among hold_keys back to
+        their shard. Returns the number of seats given back."""
+        now = datetime.utcnow()
+        expired = [hold.key for hold in ndb.get_multi(hold_keys)
+                   if hold and hold.expires < now]
+        if expired:
+            shard = shard_key.get()
+            shard.seats += len(expired)
+            shard.put()
+            ndb.delete_multi(expired)
+        return len(expired)
+
+
+    @staticmethod
+    def _releaseExpiredHolds():
+        """Give the seats of a batch of expired holds back to their shards.
+
+        Holds are released together with their shard, in one single entity
+        group transaction per shard. Queues a task for the next batch when
+        there may be more expired holds.
+        """
+        hold_keys = SeatHold.query(
+            SeatHold.expires < datetime.utcnow()
+        ).fetch(HOLD_RELEASE_BATCH_SIZE, keys_only=True)
+
+        by_shard = {}
+        for hold_key in hold_keys:
+            by_shard.setdefault(hold_key.parent(), []).append(hold_key)
+
+        released = set()
+        for shard_key, shard_hold_keys in by_shard.iteritems():
+            if ConferenceApi._releaseHolds(shard_key, shard_hold_keys):
+                released.add(shard_key.get().conference)
+
+        # cached query results and the conferences' ETags hold the seats
+        if released:
+            ConferenceApi._bumpQueryGeneration()
+            for conf_key in released:
+                etags.conferenceWritten(conf_key)
+                ConferenceApi._queueWaitlistPromotion(conf_key)
+
+        if len(hold_keys) == HOLD_RELEASE_BATCH_SIZE:
+            taskqueue.add(url='/crons/release_seat_holds', method='GET')
+
+
+    @endpoints.method(CONF_GET_REQUEST, SeatHoldForm,
+            path='conference/{websafeConferenceKey}/hold',
+            http_method='POST', name='holdSeat')
+    def holdSeat(self, request):
+        """Hold a seat at a conference for the user while they register.
+
+        The seat is kept for SEAT_HOLD_TIME; confirmRegistration turns the
+        hold into a registration. Holding again extends an existing hold.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        user_id = prof.key.id()
+        conf = self._checkEntityExists(request.websafeConferenceKey,
+                                       'conference')
+        wsck = conf.key.urlsafe()
+        if wsck in prof.conferenceKeysToAttend or \
+                self._registrationKey(prof.key, wsck).get():
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        hold = None
+        for old_hold in ndb.get_multi(seats.holdKeys(conf.key, user_id)):
+            if old_hold:
+                hold = self._extendHold(old_hold.key)
+                break
+
+        # take a seat, trying the shards with seats left in random order
+        if not hold:
+            for shard_key in seats.candidateShardKeys(seats.loadShards(conf)):
+                hold = self._holdWithShard(conf.key, shard_key, user_id)
+                if hold:
+                    break
+            else:
+                raise ConflictException(
+                    "There are no seats available.")
+            self._bumpQueryGeneration()
+            etags.conferenceWritten(conf.key)
+
+        return SeatHoldForm(websafeHoldKey=hold.key.urlsafe(),
+                            websafeConferenceKey=wsck,
+                            expires=str(hold.expires))
+
+
+    @endpoints.method(HOLD_POST_REQUEST, BooleanMessage,
+            path='hold/{websafeHoldKey}/confirm',
+            http_method='POST', name='confirmRegistration')
+    def confirmRegistration(self, request):
+        """Register the user for the conference they hold a seat at."""
+        hold = self._checkEntityExists(request.websafeHoldKey, 'seat hold')
+        self._confirmHold(hold.key)
+        return BooleanMessage(data=True)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -584,6 +1422,35 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
+    @endpoints.method(ATTENDEES_GET_REQUEST, ProfileMiniForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return a page of the users registered for a conference.
+
+        Only available to the organizer of the conference.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf = self._checkEntityExists(request.websafeConferenceKey,
+                                       'conference')
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees of the conference.')
+
+        page_size, cursor = self._getPageParams(request)
+        reg_keys, next_cursor, more = Registration.query(
+            Registration.conference == conf.key).fetch_page(
+                page_size, start_cursor=cursor, keys_only=True)
+        attendee_profiles = ndb.get_multi([reg_key.parent()
+                                           for reg_key in reg_keys])
+        return ProfileMiniForms(
+            items=PROFILE_MINI_COPIER.copyMany(attendee_profiles),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='filterPlayground', http_method='GET',
                       name='filterPlayground')
@@ -600,7 +1467,7 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month == 6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=self._copyConferencesToForms(q)
         )
 
 
@@ -608,99 +1475,180 @@ class ConferenceApi(remote.Service):
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        session_form = SessionForm()
-
-        for field in session_form.all_fields():
-            if hasattr(session, field.name):
-                # Convert date and time to stings
-                if field.name == "date" or field.name == "startTime":
-                    setattr(session_form, field.name,
-                            str(getattr(session, field.name)))
-                else:
-                    setattr(session_form, field.name,
-                            getattr(session, field.name))
-            elif field.name == "confWebsafeKey":
-                setattr(session_form, field.name,
-                        session.key.parent().urlsafe())
-            elif field.name == "websafeKey":
-                setattr(session_form, field.name, session.key.urlsafe())
-
-        session_form.check_initialized()
-        return session_form
+        return SESSION_COPIER.copy(session)
 
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
-        # Check to see if there is a user logged in. If so, get their id.
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
+    def _sessionDataFromForm(self, request):
+        """Return the Session properties given by a SessionForm."""
         # Check required properties are present.
         if not request.name:
             raise endpoints.BadRequestException("Session 'name' field required")
         if not request.typeOfSession:
             raise endpoints.BadRequestException(
                 "Session 'typeOfSession' field required")
-        if not request.confWebsafeKey:
+
+        # Copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(request, field.name)
+                for field in request.all_fields()}
+
+        # Don't need to store the conference websafe key in the session object.
+        del data['confWebsafeKey']
+        del data['websafeKey']
+
+        # Convert date and start time from strings to Date and Time objects.
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10],
+                                                 "%Y-%m-%d").date()
+
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'],
+                                                      "%H:%M").time()
+        except ValueError:
             raise endpoints.BadRequestException(
-                "Session 'confWebsafeKey' field required")
+                "Session dates must be given as YYYY-MM-DD and start times "
+                "as HH:MM")
+        return data
+
+
+    def _getOrganizedConference(self, websafe_key):
+        """Return the conference, checking the user is its organizer."""
+        # Check to see if there is a user logged in. If so, get their id.
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
 
         # Check to see if the logged in user created the conference that this
         # session is being added to.
-        conf = self._checkEntityExists(request.confWebsafeKey, 'conference')
+        conf = self._checkEntityExists(websafe_key, 'conference')
 
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the conference owner can add a session to a conference.')
+        return conf
 
-        # Copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
 
-        # Don't need to store the conference websafe key in the session object.
-        del data['confWebsafeKey']
-        del data['websafeKey']
+    def _getSpeakers(self, speaker_wssks):
+        """Return the Speakers of websafe keys, checking they all exist."""
+        speaker_keys = []
+        for wsspk in speaker_wssks:
+            speaker_key = self._getKeyIfValid(wsspk)
+            if speaker_key is None or speaker_key.kind() != 'Speaker':
+                raise endpoints.BadRequestException(
+                    'Bad or corrupt speaker websafe key: %s' % wsspk)
+            speaker_keys.append(speaker_key)
+
+        speakers = ndb.get_multi(speaker_keys)
+        missing = [wsspk for wsspk, speaker in zip(speaker_wssks, speakers)
+                   if speaker is None]
+        if missing:
+            raise endpoints.NotFoundException(
+                'No speaker found with websafe key: %s' % ', '.join(missing))
+        return speakers
 
-        # Convert date and start time from strings to Date and Time objects.
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10],
-                                             "%Y-%m-%d").date()
 
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'],
-                                                  "%H:%M").time()
+    def _putSessions(self, conf, sessions_data):
+        """Create Sessions of a conference from their property dicts.
 
-        # Generate session id and key
+        The speakers are all checked first. Ids are allocated in a single
+        range and the Sessions put in one transaction together with the
+        conference agenda, which queues a single task writing their
+        SpeakerSessions. A single featured speaker task is then queued.
+        """
+        speaker_wssks = []
+        for data in sessions_data:
+            for wsspk in data['speakerWebSafeKeys']:
+                if wsspk not in speaker_wssks:
+                    speaker_wssks.append(wsspk)
+        speakers = self._getSpeakers(speaker_wssks)
+
+        # Generate session ids and keys
         c_key = conf.key
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
+        first_id, _ = Session.allocate_ids(size=len(sessions_data),
+                                           parent=c_key)
+        sessions = []
+        for s_id, data in enumerate(sessions_data, first_id):
+            data['key'] = ndb.Key(Session, s_id, parent=c_key)
+            sessions.append(Session(**data))
+
+        # Create the session objects and put them in the database
+        self._putConferenceSessions(c_key, sessions)
+
+        tasks = [taskqueue.Task(params={'websafeKey': session.key.urlsafe()},
+                                url='/tasks/index_document')
+                 for session in sessions]
+        # Queue a task to check if the main speaker of one of these sessions
+        # should be the featured speaker
+        main_speakers = []
+        for session in sessions:
+            if session.speakerWebSafeKeys and \
+                    session.speakerWebSafeKeys[0] not in main_speakers:
+                main_speakers.append(session.speakerWebSafeKeys[0])
+        if main_speakers:
+            tasks.append(taskqueue.Task(
+                params={'websafeConferenceKey': c_key.urlsafe(),
+                        'speakerWebSafeKey': main_speakers},
+                url='/tasks/set_featured_speaker'))
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        return sessions
 
-        # Create the session object and put it in the database
-        new_session = Session(**data)
-        new_session.put()
 
-        if data['speakerWebSafeKeys']:
-            # Update the session keys in each speaker object
-            speaker_keys = [ndb.Key(urlsafe=spwsk)
-                            for spwsk in data['speakerWebSafeKeys']]
+    @ndb.transactional()
+    def _putConferenceSessions(self, conf_key, sessions):
+        """Put new sessions of a conference, rebuild its agenda, count
+        them in the duration histogram and index them under their
+        speakers."""
+        ndb.put_multi(sessions)
+        agendas.buildAgenda(conf_key, sessions).put()
+        etags.sessionWritten(conf_key)
+        taskqueue.add(params={'deltas': facets.encodeDeltas(
+            facets.durationDeltas(sessions))},
+            url='/tasks/update_facets', transactional=True
+        )
+        if any(session.speakerWebSafeKeys for session in sessions):
+            taskqueue.add(params={'websafeSessionKey': [
+                session.key.urlsafe() for session in sessions
+                if session.speakerWebSafeKeys]},
+                url='/tasks/put_speaker_sessions', transactional=True
+            )
 
-            speakers = ndb.get_multi(speaker_keys)
 
-            for speaker in speakers:
-                speaker.sessionKeys.append(new_session.key)
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        if not request.confWebsafeKey:
+            raise endpoints.BadRequestException(
+                "Session 'confWebsafeKey' field required")
+        conf = self._getOrganizedConference(request.confWebsafeKey)
+        data = self._sessionDataFromForm(request)
 
-            ndb.put_multi(speakers)
+        new_session = self._putSessions(conf, [data])[0]
+        return self._copySessionToForm(new_session)
 
-            # Queue a task to check if the speaker of this session should be
-            # a featured speaker
-            taskqueue.add(
-                params={'sessionWebsafeKey': new_session.key.urlsafe()},
-                url='/tasks/set_featured_speaker')
 
-        return self._copySessionToForm(new_session)
+    def _createSessionObjects(self, request):
+        """Create all the Sessions of a SessionForms for one conference."""
+        if len(request.items) > MAX_SESSION_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be created at once' %
+                MAX_SESSION_BATCH_SIZE)
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+
+        # the whole schedule is checked before any session is created
+        sessions_data = []
+        for index, form in enumerate(request.items):
+            try:
+                sessions_data.append(self._sessionDataFromForm(form))
+            except endpoints.BadRequestException, e:
+                raise endpoints.BadRequestException(
+                    'Session %d: %s' % (index, e))
+        if not sessions_data:
+            return SessionForms()
+
+        sessions = self._putSessions(conf, sessions_data)
+        return SessionForms(items=SESSION_COPIER.copyMany(sessions))
 
 
     @endpoints.method(SessionForm, SessionForm, path='session',
@@ -710,21 +1658,40 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+                      path='conference/{websafeConferenceKey}/sessions',
+                      http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create several new sessions of a conference at once."""
+        return self._createSessionObjects(request)
+
+
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Return all the sessions for a particular conference."""
-        # Check if a conference exists given websafeConferenceKey
-        conf = self._checkEntityExists(request.websafeConferenceKey,
-                                       'conference')
-
-        # Query for all sessions that have conf as an ancestor.
-        qry = Session.query(ancestor=conf.key)
-
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in qry]
-        )
+        # the version has to be read before the sessions; a conditional
+        # request is answered from it alone
+        conf_key = self._getKeyIfValid(request.websafeConferenceKey)
+        version = etags.getSessionsVersion(conf_key) if conf_key else None
+        etag = etags.makeEtag(version) if version is not None else None
+        if etags.matchesEtag(self._getIfNoneMatch(), etag):
+            return SessionForms(etag=etag, notModified=True)
+
+        # an agenda only exists for an existing conference; without one,
+        # check the conference and build its agenda
+        agenda = None
+        if conf_key and conf_key.kind() == 'Conference':
+            agenda = agendas.getAgenda(conf_key)
+        if agenda is None:
+            conf = self._checkEntityExists(request.websafeConferenceKey,
+                                           'conference')
+            agenda = agendas.rebuildAgenda(conf.key)
+
+        forms = agendas.agendaForms(agenda)
+        forms.etag = etag
+        return forms
 
 
     @endpoints.method(
@@ -743,24 +1710,130 @@ class ConferenceApi(remote.Service):
         qry = qry.filter(Session.typeOfSession == request.typeOfSession)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in qry]
+            items=SESSION_COPIER.copyMany(qry)
         )
 
 
+    @staticmethod
+    def _speakerSession(speaker_key, session):
+        """Return the SpeakerSession of a Session for one of its speakers."""
+        return SpeakerSession(
+            key=ndb.Key(SpeakerSession, session.key.urlsafe(),
+                        parent=speaker_key),
+            conference=session.key.parent(),
+            date=session.date,
+            startTime=session.startTime)
+
+
+    @staticmethod
+    def _speakerSessions(session):
+        """Return the SpeakerSessions of a Session, one per speaker."""
+        return [ConferenceApi._speakerSession(ndb.Key(urlsafe=wsspk), session)
+                for wsspk in set(session.speakerWebSafeKeys)]
+
+
+    @staticmethod
+    def _putSpeakerSessions(session_wssks):
+        """Index new Sessions under each of their speakers.
+
+        SpeakerSessions are keyed by session, so a rerun of the task
+        writes the same entities again.
+        """
+        sessions = ndb.get_multi([ndb.Key(urlsafe=wssk)
+                                  for wssk in session_wssks])
+        ndb.put_multi([speaker_session for session in sessions if session
+                       for speaker_session in
+                       ConferenceApi._speakerSessions(session)])
+
+
+    @staticmethod
+    def _migrateSpeakerSessions(speaker_key):
+        """Move the session keys listed in a Speaker to SpeakerSessions."""
+        speaker = speaker_key.get()
+        if not speaker or not speaker.sessionKeys:
+            return
+        # the sessions are in other entity groups, so they are read first;
+        # a session's date and start time never change
+        sessions = [session for session in ndb.get_multi(speaker.sessionKeys)
+                    if session]
+        ConferenceApi._putMigratedSpeakerSessions(speaker_key, sessions)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _putMigratedSpeakerSessions(speaker_key, sessions):
+        """Write SpeakerSessions for the sessions still listed on the speaker
+        and empty its sessionKeys, in one transaction.
+
+        The Speaker is read again inside the transaction, so sessions
+        already moved by a concurrent migration aren't written twice.
+        """
+        speaker = speaker_key.get()
+        listed = set(speaker.sessionKeys)
+        speaker_sessions = [
+            ConferenceApi._speakerSession(speaker_key, session)
+            for session in sessions if session.key in listed]
+        speaker.sessionKeys = []
+        ndb.put_multi(speaker_sessions + [speaker])
+
+
+    @staticmethod
+    def _migrateSpeakers(websafe_cursor=None):
+        """Migrate the session keys of a batch of Speakers.
+
+        Queues a task for the next batch until all Speakers are migrated.
+        """
+        cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+        speakers, next_cursor, more = Speaker.query().fetch_page(
+            SPEAKER_MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        # each Speaker and its SpeakerSessions are one entity group
+        for speaker in speakers:
+            if speaker.sessionKeys:
+                ConferenceApi._migrateSpeakerSessions(speaker.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_speaker_sessions'
+            )
+
+
     @endpoints.method(SESSION_BY_SPEAKER_GET_REQUEST, SessionForms,
                       path='speaker/{websafeSpeakerKey}/sessions',
                       http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Returns all sessions across all conferences by speaker."""
+        """Returns sessions by speaker in date order, one page at a time.
+
+        Across all conferences, or of one if websafeConferenceKey is given.
+        """
+        page_size, cursor = self._getPageParams(request)
+
         # Check if a speaker exists given the websafeSpeakerKey
         wsspk = request.websafeSpeakerKey
         speaker = self._checkEntityExists(wsspk, 'speaker')
+        # sessions not migrated yet, see _migrateSpeakers()
+        if speaker.sessionKeys:
+            self._migrateSpeakerSessions(speaker.key)
+
+        qry = SpeakerSession.query(ancestor=speaker.key)
+        if request.websafeConferenceKey:
+            conf_key = self._getKeyIfValid(request.websafeConferenceKey)
+            if conf_key is None or conf_key.kind() != 'Conference':
+                raise endpoints.BadRequestException(
+                    'Bad or corrupt conference websafe key: %s' %
+                    request.websafeConferenceKey)
+            qry = qry.filter(SpeakerSession.conference == conf_key)
+        qry = qry.order(SpeakerSession.date, SpeakerSession.startTime)
 
         # Get the sessions this speaker is speaking at
-        sessions = ndb.get_multi(speaker.sessionKeys)
+        ss_keys, next_cursor, more = qry.fetch_page(
+            page_size, start_cursor=cursor, keys_only=True)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=ss_key.id())
+                                  for ss_key in ss_keys])
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=SESSION_COPIER.copyMany(sessions),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
         )
 
 
@@ -769,7 +1842,8 @@ class ConferenceApi(remote.Service):
         http_method='GET', name='getSessionsByDuration'
     )
     def getSessionsByDuration(self, request):
-        """Get sessions of a duration between the specified min and max.
+        """Get sessions of a duration between the specified min and max,
+        one page at a time.
 
         Can also just specify a min or max duration.
         """
@@ -777,6 +1851,12 @@ class ConferenceApi(remote.Service):
         if not request.minDuration:
             request.minDuration = 0
 
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive.")
+        limit = min(limit, MAX_PAGE_SIZE)
+        cursor = self._getCursor(request.pageToken)
+
         # Session needs to be sorted first on the duration property
         qry = Session.query().order(Session.duration)
         qry = qry.filter(Session.duration >= request.minDuration)
@@ -786,8 +1866,69 @@ class ConferenceApi(remote.Service):
         if request.maxDuration:
             qry = qry.filter(Session.duration <= request.maxDuration)
 
+        sessions, next_cursor, more = qry.fetch_page(limit,
+                                                     start_cursor=cursor)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in qry]
+            items=SESSION_COPIER.copyMany(sessions),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+
+    @endpoints.method(message_types.VoidMessage, DurationHistogramForm,
+                      path='sessionDurationHistogram', http_method='GET',
+                      name='getSessionDurationHistogram')
+    def getSessionDurationHistogram(self, request):
+        """Return the number of sessions per duration range."""
+        counts = facets.getDurationCounts()
+        bounds = facets.DURATION_BUCKETS
+        items = [DurationBucketForm(
+                    minDuration=bound,
+                    maxDuration=bounds[i + 1] if i + 1 < len(bounds) else None,
+                    count=counts.get(str(bound), 0))
+                 for i, bound in enumerate(bounds)]
+        without_duration = counts.get(facets.NO_DURATION, 0)
+
+        return DurationHistogramForm(
+            items=items,
+            withoutDuration=without_duration,
+            total=sum(item.count for item in items) + without_duration
+        )
+
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+                      path='querySessions', http_method='POST',
+                      name='querySessions')
+    def querySessions(self, request):
+        """Query for sessions across all conferences, one page at a time.
+
+        Inequality filters may be used on more than one field.
+        """
+        page_size, cursor = self._getPageParams(request)
+        filters = self._formatFilters(request.filters, SESSION_FIELDS)
+        plan = planner.planQuery(Session, filters)
+
+        sessions, next_cursor, more = planner.fetchPageAsync(
+            plan.query, page_size, cursor, predicate=plan.matches).get_result()
+
+        return SessionForms(
+            items=SESSION_COPIER.copyMany(sessions),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+
+    @endpoints.method(SearchForm, SessionForms,
+                      path='searchSessions', http_method='POST',
+                      name='searchSessions')
+    def searchSessions(self, request):
+        """Search session names and highlights, best matches first."""
+        keys, next_offset = textsearch.search(
+            'Session', request.query, self._getPageSize(request),
+            self._getSearchOffset(request.pageToken))
+        sessions = ndb.get_multi(keys)
+
+        return SessionForms(
+            items=SESSION_COPIER.copyMany(sessions),
+            nextPageToken=str(next_offset) if next_offset is not None else None
         )
 
 
@@ -796,46 +1937,103 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getNonWorkshopSessionsBefore7')
     def getNonWorkshopSessionsBefore7(self, request):
         """Get sessions that are not of type 'Workshop' and are before 7 pm."""
-        # Do a query for non-workshops and get a list of keys.
-        qry_nonworkshops = Session.query(Session.typeOfSession != 'Workshop')
-        qry_nonworkshops_keys = []
-        for key in qry_nonworkshops.iter(keys_only=True):
-            qry_nonworkshops_keys.append(key)
-
-        # Do a query for sessions before 7 pm
-        qry_before_7 = Session.query(
-            Session.startTime < datetime.strptime("19:00", "%H:%M").time()
+        # The start time range is scanned in the datastore and workshops are
+        # skipped in memory as the sessions come in.
+        plan = planner.planQuery(Session, [
+            {'field': 'typeOfSession', 'operator': '!=', 'value': 'Workshop'},
+            {'field': 'startTime', 'operator': '<',
+             'value': datetime.strptime("19:00", "%H:%M").time()},
+        ])
+        sessions = planner.fetchPageAsync(
+            plan.query, predicate=plan.matches).get_result()[0]
+
+        return SessionForms(
+            items=SESSION_COPIER.copyMany(sessions)
         )
-        qry_before_7_keys = []
-        for key in qry_before_7.iter(keys_only=True):
-            qry_before_7_keys.append(key)
 
-        # Find the keys that are common between the two sets of keys
-        keys_nonworkshop_before_7 = list(set(qry_nonworkshops_keys) &
-                                         set(qry_before_7_keys))
 
-        # Get the session entities that are not workshops and before 7 pm
-        sessions = ndb.get_multi(keys_nonworkshop_before_7)
+    @endpoints.method(SessionWindowForm, SessionForms,
+                      path='getSessionsInWindow', http_method='GET',
+                      name='getSessionsInWindow')
+    def getSessionsInWindow(self, request):
+        """Get sessions starting in a time window of one day, across all
+        conferences, one page at a time.
+
+        Sessions can be limited to includeTypes and have excludeTypes left
+        out.
+        """
+        page_size, cursor = self._getPageParams(request)
+        try:
+            day = datetime.strptime(request.date[:10], "%Y-%m-%d")
+            start = day
+            if request.startTime:
+                start = datetime.combine(day.date(), datetime.strptime(
+                    request.startTime, "%H:%M").time())
+            end = day + timedelta(days=1)
+            if request.endTime:
+                end = datetime.combine(day.date(), datetime.strptime(
+                    request.endTime, "%H:%M").time())
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "The date must be given as YYYY-MM-DD and times as HH:MM")
+
+        # the window is the range scanned in the datastore; a single type
+        # is pushed down too, other type filters are applied in memory
+        filters = [
+            {'field': 'startDateTime', 'operator': '>=', 'value': start},
+            {'field': 'startDateTime', 'operator': '<', 'value': end},
+        ]
+        include_types = set(request.includeTypes) - set(request.excludeTypes)
+        if len(include_types) == 1:
+            filters.append({'field': 'typeOfSession', 'operator': '=',
+                            'value': include_types.pop()})
+        elif include_types:
+            filters.append({'field': 'typeOfSession', 'operator': 'IN',
+                            'value': include_types})
+        elif request.includeTypes:
+            # every included type is also excluded
+            return SessionForms()
+        else:
+            filters.extend({'field': 'typeOfSession', 'operator': '!=',
+                            'value': type_of_session}
+                           for type_of_session in set(request.excludeTypes))
+        plan = planner.planQuery(Session, filters)
+
+        sessions, next_cursor, more = planner.fetchPageAsync(
+            plan.query, page_size, cursor, predicate=plan.matches).get_result()
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=SESSION_COPIER.copyMany(sessions),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
         )
 
 
+    @staticmethod
+    def _migrateSessionTimes(websafe_cursor=None):
+        """Resave a batch of Sessions to set their startDateTime.
+
+        Queues a task for the next batch until all Sessions are resaved.
+        """
+        cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+        sessions, next_cursor, more = Session.query().fetch_page(
+            SESSION_MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        # startDateTime is set by Session._pre_put_hook()
+        ndb.put_multi([session for session in sessions
+                       if session.date and session.startTime and
+                       not session.startDateTime])
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_session_times'
+            )
+
+
 # - - - Speakers - - - - - - - - - - - - - - - - - - - -
 
     def _copySpeakerToForm(self, speaker):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        spf = SpeakerForm()
-
-        for field in spf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(spf, field.name, getattr(speaker, field.name))
-            elif field.name == "websafeKey":
-                setattr(spf, field.name, speaker.key.urlsafe())
-
-        spf.check_initialized()
-        return spf
+        return SPEAKER_COPIER.copy(speaker)
 
 
     def _createSpeakerObject(self, request):
@@ -885,7 +2083,7 @@ class ConferenceApi(remote.Service):
         speakers = Speaker.query()
 
         return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker) for speaker in speakers]
+            items=SPEAKER_COPIER.copyMany(speakers)
         )
 
 
@@ -897,7 +2095,7 @@ class ConferenceApi(remote.Service):
         qry = Speaker.query(Speaker.organization == request.organization)
 
         return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker) for speaker in qry]
+            items=SPEAKER_COPIER.copyMany(qry)
         )
 
 
@@ -935,6 +2133,7 @@ class ConferenceApi(remote.Service):
 
         # Write the updated profile to the datastore
         prof.put()
+        profiles.invalidate(prof.key.id(), self._profileMemo)
         return BooleanMessage(data=retval)
 
 
@@ -967,7 +2166,7 @@ class ConferenceApi(remote.Service):
 
         # Return sessions
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=SESSION_COPIER.copyMany(sessions)
         )
 
 
@@ -975,31 +2174,36 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheFeaturedSpeaker(request):
-        """Create Featured Speaker and assign to memcache."""
-        # Get the session object and its parent conference object
-        session = ndb.Key(urlsafe=request.get('sessionWebsafeKey')).get()
-        conf = session.key.parent().get()
-
-        # Query all the sessions where the principle speaker of this session
-        # is also speaking.
-        wspsk = session.speakerWebSafeKeys[0]
-        qry = Session.query(ancestor=conf.key)
-        qry = qry.filter(Session.speakerWebSafeKeys == wspsk)
+        """Create Featured Speaker and assign to memcache.
 
-        # If the featured speaker is not set, return an empty string
-        featured_speaker = ""
+        Of the speakers given for a conference, the one with the most
+        sessions there is featured if they have more than one.
+        """
+        if request.get('sessionWebsafeKey'):
+            # the main speaker of a single session
+            session = ndb.Key(urlsafe=request.get('sessionWebsafeKey')).get()
+            conf_key = session.key.parent()
+            speaker_wssks = session.speakerWebSafeKeys[:1]
+        else:
+            conf_key = ndb.Key(urlsafe=request.get('websafeConferenceKey'))
+            speaker_wssks = request.get_all('speakerWebSafeKey')
 
-        if qry.count() > 1:
-            # Get name of speaker and sessions
-            speaker_key = ndb.Key(urlsafe=wspsk)
-            speaker = speaker_key.get()
+        # Collect the names of the sessions of each speaker from the agenda
+        agenda = agendas.getAgenda(conf_key) or agendas.rebuildAgenda(conf_key)
+        session_names = {}
+        for form in agendas.agendaForms(agenda).items:
+            for wsspk in form.speakerWebSafeKeys:
+                session_names.setdefault(wsspk, []).append(form.name)
 
-            # Compile a list of session names where they are speaking.
-            sessions = qry.fetch(projection=[Session.name])
-            session_names = ', '.join(session.name for session in sessions)
+        # If the featured speaker is not set, return an empty string
+        featured_speaker = ""
 
-            featured_speaker = FEATURED_SPEAKER_TPL % (speaker.name,
-                                                       session_names)
+        wsspk = max(speaker_wssks or [None],
+                    key=lambda wsspk: len(session_names.get(wsspk, [])))
+        if len(session_names.get(wsspk, [])) > 1:
+            speaker = ndb.Key(urlsafe=wsspk).get()
+            featured_speaker = FEATURED_SPEAKER_TPL % (
+                speaker.name, ', '.join(session_names[wsspk]))
             memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featured_speaker)
 
         return featured_speaker
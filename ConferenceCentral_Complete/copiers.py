@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""copiers.py
+
+Udacity conference server-side Python App Engine entity to form copiers
+
+Copying an entity to its form message by walking all_fields() with
+hasattr/setattr costs more than the datastore read for large pages. A
+FormCopier works out once, at import time, which form fields come from
+which model properties and how each value is converted, and then copies
+entities with a plain loop over that plan.
+
+"""
+
+from operator import attrgetter
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import ProfileMiniForm
+from models import Session
+from models import SessionForm
+from models import Speaker
+from models import SpeakerForm
+from models import TeeShirtSize
+
+# property types sent to the client as their string form
+_STRING_TYPES = (ndb.DateProperty, ndb.TimeProperty, ndb.DateTimeProperty)
+
+
+def _urlsafe(key):
+    return key.urlsafe() if key else None
+
+
+def _parentUrlsafe(key):
+    return key.parent().urlsafe() if key and key.parent() else None
+
+
+class FormCopier(object):
+    """FormCopier -- copies entities of a model to a form message class"""
+
+    def __init__(self, model, form, converters=None, key_fields=None):
+        """Build the copy plan for model entities and form messages.
+
+        converters maps a field name to a function applied to the property
+        value, overriding the default conversion of date/time values to
+        strings and of keys to websafe strings. key_fields maps the names
+        of form fields that are derived from the entity key to a function
+        of that key.
+        """
+        converters = converters or {}
+        key_fields = key_fields or {}
+        self.form = form
+        self._plan = []
+        self._key_plan = []
+        for field in form.all_fields():
+            name = field.name
+            prop = model._properties.get(name)
+            if prop is not None:
+                self._plan.append((name, attrgetter(name),
+                                   self._converter(prop, converters.get(name))))
+            elif name in key_fields:
+                self._key_plan.append((name, key_fields[name]))
+        self._check = any(field.required for field in form.all_fields())
+
+    @staticmethod
+    def _converter(prop, converter):
+        """Return the function applied to values of prop, or None."""
+        if converter is None:
+            if isinstance(prop, _STRING_TYPES):
+                converter = str
+            elif isinstance(prop, ndb.KeyProperty):
+                converter = _urlsafe
+            else:
+                return None
+        if prop._repeated:
+            return lambda values: [converter(v) for v in values]
+        return converter
+
+    def copy(self, entity):
+        """Return a new form holding the fields of entity."""
+        form = self.form()
+        for name, getter, converter in self._plan:
+            value = getter(entity)
+            if converter is not None:
+                value = converter(value)
+            if value is not None:
+                setattr(form, name, value)
+        for name, derive in self._key_plan:
+            setattr(form, name, derive(entity.key))
+        if self._check:
+            form.check_initialized()
+        return form
+
+    def copyMany(self, entities):
+        """Return forms for entities, skipping None (missing) entities."""
+        copy = self.copy
+        return [copy(entity) for entity in entities if entity is not None]
+
+
+CONFERENCE_COPIER = FormCopier(
+    Conference, ConferenceForm,
+    key_fields={'websafeKey': _urlsafe})
+
+PROFILE_COPIER = FormCopier(
+    Profile, ProfileForm,
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)})
+
+PROFILE_MINI_COPIER = FormCopier(
+    Profile, ProfileMiniForm,
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)})
+
+SESSION_COPIER = FormCopier(
+    Session, SessionForm,
+    key_fields={'websafeKey': _urlsafe, 'confWebsafeKey': _parentUrlsafe})
+
+SPEAKER_COPIER = FormCopier(
+    Speaker, SpeakerForm,
+    key_fields={'websafeKey': _urlsafe})
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""etags.py
+
+Udacity conference server-side Python App Engine entity tags
+
+Conference entities carry a version that is bumped on every put. The
+current ETag of each conference (its version and seats available), and a
+counter bumped once per write of some of its sessions, are kept in
+memcache so that a request whose If-None-Match header carries the current
+ETag can be answered with just the ETag and notModified set, without
+reading the datastore.
+
+Writers only touch memcache once their transaction has committed. A
+conference's ETag is deleted with a short lock against add(), so a reader
+that read the data before the commit can't put back the old ETag. A lost
+value just means a full response.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_CONFERENCE_ETAG_TPL = 'conferenceEtag:%s'
+MEMCACHE_SESSIONS_VERSION_TPL = 'conferenceSessionsVersion:%s'
+VERSION_CACHE_TIME = 3600
+# longer than a read of the conference may take
+ETAG_LOCK_TIME = 10  # seconds
+
+
+def makeEtag(*parts):
+    """Return the (quoted) ETag of a version made of parts."""
+    return '"%s"' % '-'.join(str(part) for part in parts)
+
+
+def matchesEtag(header, etag):
+    """Return True if an If-None-Match header value matches etag."""
+    if not header or not etag:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def conferenceWritten(conf_key):
+    """Drop the cached ETag of a conference once the write commits."""
+    ndb.get_context().call_on_commit(lambda: memcache.delete(
+        MEMCACHE_CONFERENCE_ETAG_TPL % conf_key.urlsafe(),
+        seconds=ETAG_LOCK_TIME))
+
+
+def getConferenceEtag(conf_key):
+    """Return the cached ETag of a conference, or None."""
+    return memcache.get(MEMCACHE_CONFERENCE_ETAG_TPL % conf_key.urlsafe())
+
+
+def cacheConferenceEtag(conf_key, etag):
+    """Cache the ETag of a conference just read, unless already known."""
+    memcache.add(MEMCACHE_CONFERENCE_ETAG_TPL % conf_key.urlsafe(),
+                 etag, time=VERSION_CACHE_TIME)
+
+
+def sessionWritten(conf_key):
+    """Change the version of the sessions of a conference once the write
+    commits."""
+    ndb.get_context().call_on_commit(lambda: memcache.incr(
+        MEMCACHE_SESSIONS_VERSION_TPL % conf_key.urlsafe(),
+        initial_value=int(time.time() * 1000)))
+
+
+def getSessionsVersion(conf_key):
+    """Return the version of the sessions of a conference, or None.
+
+    Must be read before the sessions themselves, so that a write racing
+    with the read can only make the ETag older than the data.
+    """
+    key = MEMCACHE_SESSIONS_VERSION_TPL % conf_key.urlsafe()
+    version = memcache.get(key)
+    if version is None:
+        # seed a lost counter from the clock so that it can't go back to
+        # a version a client may still hold
+        memcache.add(key, int(time.time() * 1000))
+        version = memcache.get(key)
+    return version
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Udacity conference server-side Python App Engine facet counters
+
+The number of conferences per city, topic and month is kept in sharded
+counters. Each FacetShard entity holds the counts of every value of one
+field, so reading all the counts is a single get_multi of
+len(FACET_FIELDS) * NUM_SHARDS keys, and each write only touches one
+randomly picked shard per field.
+
+The number of sessions per duration bucket is kept the same way, under
+the DURATION_FIELD field, so that clients can see how many sessions a
+duration range holds before paging through them.
+
+Count changes are added from tasks, which may run more than once. The
+name of the task is stored in an AppliedFacetDeltas entity in the
+transaction that adds its changes, so a rerun adds nothing. These
+records are deleted by a daily cron job once APPLIED_DELTAS_LIFETIME has
+passed, long after the task could be retried.
+
+"""
+
+from datetime import datetime
+from datetime import timedelta
+import json
+import random
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import AppliedFacetDeltas
+from models import Conference
+from models import FacetShard
+from models import Session
+
+FACET_FIELDS = ('city', 'topics', 'month')
+NUM_SHARDS = 20
+
+DURATION_FIELD = 'sessionDuration'
+# lower bounds, in minutes, of the session duration buckets
+DURATION_BUCKETS = (0, 15, 30, 45, 60, 90, 120, 180, 240)
+NO_DURATION = 'none'
+
+# entities counted per task by the rebuild functions
+REBUILD_BATCH_SIZE = 100
+# how long the names of applied tasks are kept; the default queue backs
+# off to an hour between retries, so a task still failing after this long
+# has long been looked into
+APPLIED_DELTAS_LIFETIME = timedelta(days=7)
+APPLIED_DELTAS_DELETE_BATCH_SIZE = 500
+
+
+def _shardKey(field, index):
+    return ndb.Key(FacetShard, '%s-%d' % (field, index))
+
+
+def facetValues(conf):
+    """Return the facet values of conf as a dict of field -> [str]."""
+    values = {}
+    for field in FACET_FIELDS:
+        value = getattr(conf, field, None)
+        if value in (None, []):
+            values[field] = []
+        elif isinstance(value, list):
+            values[field] = sorted(set(unicode(v) for v in value))
+        else:
+            values[field] = [unicode(value)]
+    return values
+
+
+def durationBucket(duration):
+    """Return the name of the duration bucket of a session duration."""
+    if duration is None:
+        return NO_DURATION
+    bucket = DURATION_BUCKETS[0]
+    for bound in DURATION_BUCKETS:
+        if duration < bound:
+            break
+        bucket = bound
+    return str(bucket)
+
+
+def durationDeltas(sessions):
+    """Return the count changes for sessions being created."""
+    deltas = {}
+    for session in sessions:
+        bucket = durationBucket(session.duration)
+        deltas[bucket] = deltas.get(bucket, 0) + 1
+    return {DURATION_FIELD: deltas}
+
+
+def countDeltas(old_values=None, new_values=None):
+    """Return the count changes for a conference going from old to new values.
+
+    Either side may be None, for a conference being created or removed.
+    The result maps field -> {value: delta}, leaving out zero deltas.
+    """
+    deltas = {}
+    for sign, values in ((-1, old_values), (1, new_values)):
+        for field, field_values in (values or {}).iteritems():
+            for value in field_values:
+                field_deltas = deltas.setdefault(field, {})
+                field_deltas[value] = field_deltas.get(value, 0) + sign
+    for field in deltas.keys():
+        deltas[field] = dict((v, d) for v, d in deltas[field].iteritems() if d)
+        if not deltas[field]:
+            del deltas[field]
+    return deltas
+
+
+def encodeDeltas(deltas):
+    return json.dumps(deltas)
+
+
+@ndb.transactional(xg=True)
+def applyDeltas(deltas, deltas_id=None):
+    """Add deltas to one randomly chosen shard of each field.
+
+    deltas_id names this change, usually after the task making it; a
+    change whose name was already applied is skipped.
+    """
+    if deltas_id:
+        applied_key = ndb.Key(AppliedFacetDeltas, deltas_id)
+        if applied_key.get():
+            return
+        AppliedFacetDeltas(key=applied_key).put()
+    fields = sorted(deltas)
+    keys = [_shardKey(field, random.randint(0, NUM_SHARDS - 1))
+            for field in fields]
+    shards = ndb.get_multi(keys)
+    for i, field in enumerate(fields):
+        shard = shards[i] = shards[i] or FacetShard(key=keys[i])
+        counts = shard.counts or {}
+        for value, delta in deltas[field].iteritems():
+            counts[value] = counts.get(value, 0) + delta
+            if not counts[value]:
+                del counts[value]
+        shard.counts = counts
+    ndb.put_multi(shards)
+
+
+def applyEncodedDeltas(encoded, deltas_id=None):
+    applyDeltas(json.loads(encoded), deltas_id)
+
+
+def deleteExpiredAppliedDeltas():
+    """Delete a batch of AppliedFacetDeltas past APPLIED_DELTAS_LIFETIME.
+
+    Queues a task for the next batch when there may be more.
+    """
+    keys = AppliedFacetDeltas.query(
+        AppliedFacetDeltas.applied < datetime.utcnow() - APPLIED_DELTAS_LIFETIME
+    ).fetch(APPLIED_DELTAS_DELETE_BATCH_SIZE, keys_only=True)
+    ndb.delete_multi(keys)
+    if len(keys) == APPLIED_DELTAS_DELETE_BATCH_SIZE:
+        taskqueue.add(url='/crons/delete_applied_facet_deltas', method='GET')
+
+
+def clearCounts(facet_fields):
+    """Remove all the counts of facet_fields, before rebuilding them."""
+    ndb.delete_multi([_shardKey(field, index) for field in facet_fields
+                      for index in range(NUM_SHARDS)])
+
+
+def rebuildConferenceCounts(websafe_cursor=None, deltas_id=None):
+    """Count a batch of Conferences into the cleared FACET_FIELDS counts.
+
+    Queues a task for the next batch until all Conferences are counted.
+    Conferences edited while the counts are rebuilt may be counted twice,
+    so the rebuild is best run when conferences aren't being written.
+    """
+    cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+    confs, next_cursor, more = Conference.query().fetch_page(
+        REBUILD_BATCH_SIZE, start_cursor=cursor)
+
+    new_values = {}
+    for conf in confs:
+        for field, values in facetValues(conf).iteritems():
+            new_values.setdefault(field, []).extend(values)
+    deltas = countDeltas(new_values=new_values)
+    if deltas:
+        applyDeltas(deltas, deltas_id)
+
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/rebuild_conference_facets')
+
+
+def rebuildDurationCounts(websafe_cursor=None, deltas_id=None):
+    """Count a batch of Sessions into the cleared duration bucket counts.
+
+    Queues a task for the next batch until all Sessions are counted.
+    Sessions created while the counts are rebuilt may be counted twice.
+    """
+    cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+    sessions, next_cursor, more = Session.query().fetch_page(
+        REBUILD_BATCH_SIZE, start_cursor=cursor)
+
+    if sessions:
+        applyDeltas(durationDeltas(sessions), deltas_id)
+
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/rebuild_session_durations')
+
+
+def getCounts(facet_fields=FACET_FIELDS):
+    """Return the counts of facet_fields as a dict of field -> {value: count}."""
+    fields = [(field, index) for field in facet_fields
+              for index in range(NUM_SHARDS)]
+    shards = ndb.get_multi([_shardKey(field, index) for field, index in fields])
+
+    counts = dict((field, {}) for field in facet_fields)
+    for (field, _), shard in zip(fields, shards):
+        if shard and shard.counts:
+            for value, count in shard.counts.iteritems():
+                counts[field][value] = counts[field].get(value, 0) + count
+    for field in facet_fields:
+        counts[field] = dict((v, c) for v, c in counts[field].iteritems() if c > 0)
+    return counts
+
+
+def getDurationCounts():
+    """Return the session counts per duration bucket as a dict of
+    bucket -> count."""
+    return getCounts((DURATION_FIELD,))[DURATION_FIELD]
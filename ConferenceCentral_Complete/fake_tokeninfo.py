@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""fake_tokeninfo.py
+
+Udacity conference fake Google token server
+
+Stands in for Google's tokeninfo and certs endpoints so that the token
+verification in tokens.py can be exercised offline. Generates an RSA key,
+serves it as a JWK set on /certs, answers /tokeninfo for the tokens it
+issued, and prints an ID token and an access token for --user.
+
+Usage:
+    python fake_tokeninfo.py [--port N] [--user ID] [--audience CLIENT_ID]
+        [--lifetime SECONDS] [--certs-max-age SECONDS]
+
+then run the app with
+    dev_appserver.py --env_var TOKENINFO_URL=http://localhost:N/tokeninfo
+        --env_var OAUTH_CERTS_URL=http://localhost:N/certs .
+
+Every request is logged, so it shows which lookups reach the network.
+Needs pycrypto.
+
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import sys
+import time
+import urlparse
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+KEY_ID = 'fake-key-1'
+ISSUER = 'https://accounts.google.com'
+
+
+def b64encode(data):
+    """Encode data as unpadded base64url."""
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def encodeLong(value):
+    """Encode a positive integer as big-endian base64url."""
+    hex_value = '%x' % value
+    return b64encode(binascii.unhexlify('0' * (len(hex_value) % 2) + hex_value))
+
+
+class FakeTokenServer(HTTPServer):
+    """FakeTokenServer -- issues and answers for tokens of one RSA key"""
+
+    def __init__(self, args):
+        HTTPServer.__init__(self, ('', args.port), FakeTokenHandler)
+        self.args = args
+        self.key = RSA.generate(2048)
+        # token -> tokeninfo response
+        self.tokens = {}
+
+    def jwks(self):
+        return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig',
+                          'kid': KEY_ID, 'n': encodeLong(self.key.n),
+                          'e': encodeLong(self.key.e)}]}
+
+    def issueIdToken(self, user_id):
+        now = int(time.time())
+        header = {'alg': 'RS256', 'kid': KEY_ID, 'typ': 'JWT'}
+        payload = {'iss': ISSUER, 'aud': self.args.audience, 'sub': user_id,
+                   'iat': now, 'exp': now + self.args.lifetime}
+        signing_input = '%s.%s' % (b64encode(json.dumps(header)),
+                                   b64encode(json.dumps(payload)))
+        signature = PKCS1_v1_5.new(self.key).sign(SHA256.new(signing_input))
+        token = '%s.%s' % (signing_input, b64encode(signature))
+        self.tokens[token] = dict(payload, user_id=user_id)
+        return token
+
+    def issueAccessToken(self, user_id):
+        token = 'fake.%s' % uuid.uuid4().hex
+        self.tokens[token] = {'user_id': user_id,
+                              'audience': self.args.audience,
+                              'exp': int(time.time()) + self.args.lifetime}
+        return token
+
+    def tokeninfo(self, token):
+        """Return the tokeninfo response for token, or None if invalid."""
+        info = self.tokens.get(token)
+        if info is None or info['exp'] <= time.time():
+            return None
+        info = dict(info)
+        info['expires_in'] = int(info.pop('exp') - time.time())
+        return info
+
+
+class FakeTokenHandler(BaseHTTPRequestHandler):
+    """FakeTokenHandler -- the /certs and /tokeninfo endpoints"""
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/certs':
+            self.reply(200, self.server.jwks(), 'public, max-age=%d' %
+                       self.server.args.certs_max_age)
+        elif url.path == '/tokeninfo':
+            params = urlparse.parse_qs(url.query)
+            token = (params.get('id_token') or params.get('access_token') or
+                     [''])[0]
+            info = self.server.tokeninfo(token)
+            if info is None:
+                self.reply(400, {'error': 'invalid_token'})
+            else:
+                self.reply(200, info)
+        else:
+            self.reply(404, {'error': 'not_found'})
+
+    def reply(self, status, body, cache_control='no-cache'):
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--user', default='1234567890',
+                        help='Google user id the tokens are issued for')
+    parser.add_argument('--audience', default=None,
+                        help='client id the tokens are issued to '
+                             '(default: settings.WEB_CLIENT_ID)')
+    parser.add_argument('--lifetime', type=int, default=3600,
+                        help='seconds the tokens are valid')
+    parser.add_argument('--certs-max-age', type=int, default=3600,
+                        help='seconds clients may cache the key set')
+    args = parser.parse_args(argv)
+    if args.audience is None:
+        from settings import WEB_CLIENT_ID
+        args.audience = WEB_CLIENT_ID
+
+    server = FakeTokenServer(args)
+    print 'serving on http://localhost:%d/tokeninfo and /certs' % args.port
+    print 'ID token:     %s' % server.issueIdToken(args.user)
+    print 'access token: %s' % server.issueAccessToken(args.user)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""index_advisor.py
+
+Udacity conference composite index advisor
+
+Enumerates the query shapes queryConferences and querySessions can send
+to the datastore for the filters in FIELDS, SESSION_FIELDS and OPERATORS,
+works out the smallest set of Conference and Session composite indexes
+that serves all of them and reports how many index rows each put() writes
+with the current and the advised index.yaml.
+
+The datastore can answer a query with several equality filters by merging
+(zigzag merge join) indexes that each hold some of the equality properties
+followed by the same suffix: the inequality property, if any, then the
+sort orders. So one index per (equality property, suffix) is enough and
+the combinations of equality properties never need their own index.
+
+Usage:
+    python index_advisor.py [--topics N] [--output FILE]
+
+Runs without the App Engine SDK: the filter fields, OPERATORS and the
+models are read from the source of conference.py and models.py.
+
+"""
+
+import argparse
+import ast
+import itertools
+import os
+import sys
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# kind -> (filter fields in conference.py, sort order after the pushed
+# down inequality, shapes of other queries on the kind)
+KINDS = (
+    # _getQuery sorts on name
+    ('Conference', 'FIELDS', ('name',), ()),
+    # querySessions doesn't sort; getSessionsInWindow filters on a type
+    # and scans a startDateTime range
+    ('Session', 'SESSION_FIELDS', (),
+     ((frozenset(['typeOfSession']), ('startDateTime',)),)),
+)
+# operators the planner pushes down to the datastore; '!=' is always
+# evaluated in memory (see planner.py)
+PUSHED_INEQUALITIES = ('<', '<=', '>', '>=')
+
+HEADER = '''indexes:
+
+# Conference and Session indexes generated by index_advisor.py; run it
+# again after changing FIELDS, SESSION_FIELDS, OPERATORS or the queries
+# listed in its KINDS.
+'''
+
+AUTOGENERATED = '''# AUTOGENERATED
+
+# This index.yaml is automatically updated whenever the dev_appserver
+# detects that a new type of query is run.  If you want to manage the
+# index.yaml file manually, remove the above marker line (the line
+# saying "# AUTOGENERATED").  If you want to manage some indexes
+# manually, move them above the marker line.  The index.yaml file is
+# automatically uploaded to the admin console when you next deploy
+# your application using appcfg.py.
+'''
+
+
+def readAssignment(path, name):
+    """Return the literal value assigned to name at the top of a module."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and \
+                any(getattr(t, 'id', None) == name for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError('%s not found in %s' % (name, path))
+
+
+def readModel(path, kind):
+    """Return {property: (repeated, indexed)} for an ndb model class."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == kind:
+            break
+    else:
+        raise ValueError('%s not found in %s' % (kind, path))
+
+    properties = {}
+    for stmt in node.body:
+        if not (isinstance(stmt, ast.Assign) and isinstance(stmt.value, ast.Call)):
+            continue
+        options = dict((kw.arg, kw.value) for kw in stmt.value.keywords)
+        flag = lambda name, default: (
+            options[name].id == 'True' if name in options else default)
+        # Text, Blob and Json properties are never indexed
+        prop_type = getattr(stmt.value.func, 'attr', '')
+        indexed = prop_type not in ('TextProperty', 'BlobProperty', 'JsonProperty')
+        properties[stmt.targets[0].id] = (flag('repeated', False),
+                                          flag('indexed', indexed))
+    return properties
+
+
+def queryShapes(fields, operators, sort_order):
+    """Return the (equality properties, suffix) shapes a query on fields
+    sorted on sort_order can emit."""
+    pushed = set(operators.values()).intersection(PUSHED_INEQUALITIES)
+    shapes = set()
+    for n in range(len(fields) + 1):
+        for equalities in itertools.combinations(fields, n):
+            shapes.add((frozenset(equalities), sort_order))
+            for inequality in (fields if pushed else ()):
+                if inequality not in equalities:
+                    shapes.add((frozenset(equalities),
+                                (inequality,) + sort_order))
+    return shapes
+
+
+def canServe(indexes, shape):
+    """Return True if indexes (tuples of properties) can serve shape."""
+    equalities, suffix = shape
+    if not suffix:
+        # equality filters alone are merge-joined from the built-in indexes
+        return True
+    if not equalities:
+        # single property sorts are served by the built-in indexes
+        return len(suffix) == 1 or suffix in indexes
+    covered = set()
+    for index in indexes:
+        prefix = index[:-len(suffix)]
+        if index[-len(suffix):] == suffix and prefix and \
+                set(prefix) <= equalities:
+            covered.update(prefix)
+    return covered == equalities
+
+
+def adviseIndexes(shapes):
+    """Return the smallest merge-join friendly index set serving shapes."""
+    indexes = set()
+    for equalities, suffix in shapes:
+        if not suffix:
+            continue
+        if not equalities and len(suffix) > 1:
+            indexes.add(suffix)
+        for prop in equalities:
+            indexes.add((prop,) + suffix)
+    return sorted(indexes, key=lambda index: (len(index), index))
+
+
+def rowsPerEntity(index, properties, topics):
+    """Return the index rows one entity writes to a composite index."""
+    rows = 1
+    for prop in index:
+        if properties.get(prop, (False, True))[0]:
+            rows *= topics
+    return rows
+
+
+def builtinRows(properties, topics):
+    """Return the rows one entity writes to the built-in indexes."""
+    rows = 0
+    for repeated, indexed in properties.itervalues():
+        if indexed:
+            # one ascending and one descending row per value
+            rows += 2 * (topics if repeated else 1)
+    return rows
+
+
+def readIndexes(path):
+    """Return the composite indexes of index.yaml as (kind, props, raw)."""
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    indexes = []
+    for raw in config.get('indexes') or []:
+        props = tuple(p['name'] for p in raw.get('properties', []))
+        indexes.append((raw['kind'], props, raw))
+    return indexes
+
+
+def formatIndex(raw):
+    lines = ['- kind: %s' % raw['kind']]
+    if raw.get('ancestor'):
+        lines.append('  ancestor: yes')
+    lines.append('  properties:')
+    for prop in raw.get('properties', []):
+        lines.append('  - name: %s' % prop['name'])
+        if prop.get('direction'):
+            lines.append('    direction: %s' % prop['direction'])
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--topics', type=int, default=2,
+                        help='average number of values of repeated properties')
+    parser.add_argument('--index-file', default=os.path.join(HERE, 'index.yaml'))
+    parser.add_argument('--output', help='write the advised index.yaml here')
+    args = parser.parse_args(argv)
+
+    source = os.path.join(HERE, 'conference.py')
+    operators = readAssignment(source, 'OPERATORS')
+    current = readIndexes(args.index_file)
+    out = sys.stdout if args.output else sys.stderr
+
+    advised_yaml = [HEADER]
+    for kind, fields_name, sort_order, other_shapes in KINDS:
+        fields = sorted(readAssignment(source, fields_name).values())
+        properties = readModel(os.path.join(HERE, 'models.py'), kind)
+        current_props = set(props for k, props, _ in current if k == kind)
+
+        shapes = queryShapes(fields, operators, sort_order)
+        shapes.update(other_shapes)
+        advised = adviseIndexes(shapes)
+        missing = [shape for shape in shapes
+                   if not canServe(current_props, shape)]
+
+        builtin = builtinRows(properties, args.topics)
+        print >> out, '%s: %d query shapes from %s %s' % (
+            kind, len(shapes), fields_name, ', '.join(fields))
+        print >> out, '%d shapes not served by %s' % (
+            len(missing), os.path.basename(args.index_file))
+        missing.sort(key=lambda (equalities, suffix): (
+            len(equalities), sorted(equalities), suffix))
+        for equalities, suffix in missing:
+            print >> out, '  equality on %s, sorted on %s' % (
+                ', '.join(sorted(equalities)) or '-', ', '.join(suffix) or '-')
+        print >> out
+        print >> out, 'index rows written per %s (%d values per repeated ' \
+            'property):' % (kind, args.topics)
+        print >> out, '  built-in indexes          %4d' % builtin
+        for label, indexes in (('current', sorted(current_props)),
+                               ('advised', advised)):
+            rows = sum(rowsPerEntity(i, properties, args.topics)
+                       for i in indexes)
+            print >> out, '  %s: %2d composites %4d rows, %4d in total' % (
+                label, len(indexes), rows, builtin + rows)
+        print >> out
+
+        for props in advised:
+            advised_yaml.append(formatIndex({
+                'kind': kind, 'properties': [{'name': p} for p in props]}) + '\n')
+
+    advised_yaml.append(AUTOGENERATED)
+    generated = set(kind for kind, _, _, _ in KINDS)
+    for kind, _, raw in current:
+        if kind not in generated:
+            advised_yaml.append(formatIndex(raw) + '\n')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(advised_yaml))
+    else:
+        sys.stdout.write('\n'.join(advised_yaml))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
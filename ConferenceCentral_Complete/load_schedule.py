@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""load_schedule.py
+
+Udacity conference schedule loader
+
+Reads the sessions of a conference from a JSON or CSV file, checks all
+of them, and creates them with the createSessions endpoint in batches of
+at most --batch-size sessions.
+
+A JSON file holds a list of SessionForm objects, or an object with an
+"items" list of them. A CSV file has a header row naming SessionForm
+fields (name, typeOfSession, highlights, speakerWebSafeKeys, duration,
+date, startTime); repeated fields are separated by semicolons.
+
+Usage:
+    python load_schedule.py --conference WEBSAFE_KEY --token TOKEN
+        [--api URL] [--batch-size N] [--dry-run] FILE
+
+The token is an OAuth bearer token of the conference organizer; it may be
+given in the OAUTH_TOKEN environment variable instead.
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import urllib2
+from datetime import datetime
+
+DEFAULT_API = 'http://localhost:8080/_ah/api'
+API_PATH = '/conference/v1/conference/%s/sessions'
+# the most createSessions accepts at once
+MAX_BATCH_SIZE = 500
+
+FIELDS = ('name', 'typeOfSession', 'highlights', 'speakerWebSafeKeys',
+          'duration', 'date', 'startTime')
+REPEATED_FIELDS = ('highlights', 'speakerWebSafeKeys')
+
+
+class ScheduleError(Exception):
+    """ScheduleError -- a schedule file that can't be loaded"""
+
+
+def readJson(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('items', [])
+    if not isinstance(data, list):
+        raise ScheduleError('%s: expected a list of sessions' % path)
+    return data
+
+
+def readCsv(path):
+    sessions = []
+    with open(path, 'rb') as f:
+        for row in csv.DictReader(f):
+            session = {}
+            for field, value in row.iteritems():
+                field = (field or '').strip()
+                value = (value or '').strip().decode('utf-8')
+                if not value:
+                    continue
+                if field in REPEATED_FIELDS:
+                    value = [v.strip() for v in value.split(';') if v.strip()]
+                session[field] = value
+            sessions.append(session)
+    return sessions
+
+
+def checkSession(index, session):
+    """Return session as a SessionForm dict, or raise ScheduleError."""
+    def fail(message):
+        raise ScheduleError('session %d (%s): %s' % (
+            index, session.get('name', 'unnamed'), message))
+
+    if not isinstance(session, dict):
+        fail('not an object')
+    unknown = set(session) - set(FIELDS)
+    if unknown:
+        fail('unknown fields %s' % ', '.join(sorted(unknown)))
+    for field in ('name', 'typeOfSession'):
+        if not session.get(field):
+            fail("'%s' is required" % field)
+
+    form = dict(session)
+    for field in REPEATED_FIELDS:
+        if isinstance(form.get(field), basestring):
+            form[field] = [form[field]]
+    if form.get('duration') not in (None, ''):
+        try:
+            form['duration'] = int(form['duration'])
+        except (TypeError, ValueError):
+            fail("'duration' must be a number of minutes")
+    for field, fmt, example in (('date', '%Y-%m-%d', 'YYYY-MM-DD'),
+                                ('startTime', '%H:%M', 'HH:MM')):
+        if form.get(field):
+            try:
+                datetime.strptime(form[field], fmt)
+            except (TypeError, ValueError):
+                fail("'%s' must be given as %s" % (field, example))
+    return form
+
+
+def postSessions(api, conference, token, forms):
+    """Create forms with one createSessions call; return the created ones."""
+    request = urllib2.Request(
+        api.rstrip('/') + API_PATH % conference,
+        json.dumps({'items': forms}),
+        {'Content-Type': 'application/json',
+         'Authorization': 'Bearer %s' % token})
+    try:
+        return json.load(urllib2.urlopen(request)).get('items', [])
+    except urllib2.HTTPError, e:
+        raise ScheduleError('createSessions failed with %d: %s' % (
+            e.code, e.read()))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('file', help='JSON or CSV schedule')
+    parser.add_argument('--conference', required=True,
+                        help='websafe key of the conference')
+    parser.add_argument('--token', default=os.environ.get('OAUTH_TOKEN'),
+                        help='OAuth bearer token of the organizer')
+    parser.add_argument('--api', default=DEFAULT_API,
+                        help='API root (default %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only check the schedule')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.file.lower().endswith('.csv'):
+            sessions = readCsv(args.file)
+        else:
+            sessions = readJson(args.file)
+        forms = [checkSession(i, session) for i, session in enumerate(sessions)]
+        print '%d sessions checked' % len(forms)
+        if args.dry_run or not forms:
+            return 0
+        if not args.token:
+            raise ScheduleError('an OAuth token is needed, see --token')
+
+        batch_size = max(1, min(args.batch_size, MAX_BATCH_SIZE))
+        created = 0
+        for i in range(0, len(forms), batch_size):
+            created += len(postSessions(args.api, args.conference, args.token,
+                                        forms[i:i + batch_size]))
+            print '%d of %d sessions created' % (created, len(forms))
+    except (IOError, ValueError, ScheduleError), e:
+        print >> sys.stderr, 'error: %s' % e
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
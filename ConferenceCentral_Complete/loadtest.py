@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""loadtest.py
+
+Udacity conference registration load test
+
+Runs ConferenceApi against the App Engine testbed datastore, memcache and
+task queue stubs, creates one conference and has many users register for
+it at the same time from a pool of threads, some of them unregistering
+again. Reports throughput, latency percentiles, the datastore transactions
+begun and committed (the difference being retried or abandoned attempts)
+and checks that the seats left and the registrations add up.
+
+Usage:
+    python loadtest.py --sdk /path/to/google_appengine [--users N]
+        [--seats N] [--threads N] [--unregister FRACTION]
+
+Runs offline; only the App Engine SDK is needed.
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def setupSdk(sdk_path):
+    """Put the App Engine SDK and this app on sys.path."""
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, HERE)
+
+
+def percentile(values, p):
+    """Return the p-th percentile (nearest rank) of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1)]
+
+
+class LoadTest(object):
+    """LoadTest -- concurrent registrations for one conference"""
+
+    def __init__(self, args):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.args = args
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='loadtest')
+        # strongly consistent, so only transaction conflicts are measured
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=HERE)
+
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'loadtest', self._countCall, 'datastore_v3')
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'loadtest', self._countCommit, 'datastore_v3')
+
+        # endpoints only knows the current user inside a request, so each
+        # thread says who it is acting for
+        import endpoints
+        from google.appengine.api import users
+        self.local = threading.local()
+        endpoints.get_current_user = lambda: getattr(self.local, 'user', None)
+        self.users = users
+
+    def _countCall(self, service, call, request, response):
+        if call in ('BeginTransaction', 'Rollback'):
+            with self.lock:
+                self.calls[call] += 1
+
+    def _countCommit(self, service, call, request, response, rpc=None,
+                     error=None):
+        if call == 'Commit' and error is None:
+            with self.lock:
+                self.calls[call] += 1
+
+    def actAs(self, email):
+        self.local.user = self.users.User(email=email)
+
+    def createConference(self):
+        """Create the conference and return its websafe key."""
+        from conference import ConferenceApi
+        from models import Conference
+        from models import ConferenceForm
+
+        self.actAs('organizer@example.com')
+        ConferenceApi().createConference(ConferenceForm(
+            name='Load test', maxAttendees=self.args.seats))
+        return Conference.query().get().key.urlsafe()
+
+    def runUser(self, index, wsck):
+        """Register one user, maybe unregister again; return the outcomes."""
+        from conference import ConferenceApi
+        from conference import CONF_GET_REQUEST
+        from google.appengine.ext import ndb
+        from models import ConflictException
+
+        # every thread needs its own ndb context, without a stale cache
+        ndb.get_context().clear_cache()
+        self.actAs('user%d@example.com' % index)
+        api = ConferenceApi()
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck)
+        results = []
+
+        start = time.time()
+        try:
+            api.registerForConference(request)
+            results.append(('registered', time.time() - start))
+        except ConflictException:
+            results.append(('sold out', time.time() - start))
+            return results
+        except Exception:
+            results.append(('failed', time.time() - start))
+            return results
+
+        if random.random() < self.args.unregister:
+            start = time.time()
+            try:
+                api.unregisterFromConference(request)
+                results.append(('unregistered', time.time() - start))
+            except Exception:
+                results.append(('failed', time.time() - start))
+        return results
+
+    def checkSeats(self, wsck, outcomes):
+        """Return (seats left, registrations, ok) after the run."""
+        from google.appengine.ext import ndb
+        from models import Registration
+        import seats
+
+        ndb.get_context().clear_cache()
+        conf = ndb.Key(urlsafe=wsck).get()
+        seats_left = seats.getSeatsAvailable([conf])[0]
+        registrations = Registration.query(
+            Registration.conference == conf.key).count()
+        expected = outcomes['registered'] - outcomes['unregistered']
+        ok = (registrations == expected and
+              seats_left == self.args.seats - expected and
+              seats_left >= 0)
+        return seats_left, registrations, ok
+
+    def run(self):
+        from multiprocessing.pool import ThreadPool
+
+        wsck = self.createConference()
+        self.calls.clear()
+
+        pool = ThreadPool(self.args.threads)
+        start = time.time()
+        runs = pool.map(lambda i: self.runUser(i, wsck), range(self.args.users))
+        elapsed = time.time() - start
+        pool.close()
+
+        outcomes = Counter()
+        latencies = []
+        for results in runs:
+            for outcome, latency in results:
+                outcomes[outcome] += 1
+                latencies.append(latency * 1000)
+        latencies.sort()
+        seats_left, registrations, ok = self.checkSeats(wsck, outcomes)
+
+        print '%d users, %d seats, %d threads' % (
+            self.args.users, self.args.seats, self.args.threads)
+        print '%s in %.2f s (%.1f requests/s)' % (
+            ', '.join('%d %s' % (count, outcome)
+                      for outcome, count in sorted(outcomes.items())),
+            elapsed, len(latencies) / elapsed)
+        print 'latency p50 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+            percentile(latencies, 50), percentile(latencies, 99),
+            latencies[-1] if latencies else 0.0)
+        print 'transactions: %d begun, %d committed, %d rolled back, ' \
+            '%d retried or failed' % (
+                self.calls['BeginTransaction'], self.calls['Commit'],
+                self.calls['Rollback'], self.calls['BeginTransaction'] -
+                self.calls['Commit'] - self.calls['Rollback'])
+        print 'seats left %d, registrations %d: %s' % (
+            seats_left, registrations, 'OK' if ok else 'MISMATCH')
+        self.testbed.deactivate()
+        return ok
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seats', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--unregister', type=float, default=0.1,
+                        help='fraction of registered users who unregister')
+    args = parser.parse_args(argv)
+
+    setupSdk(args.sdk)
+    return 0 if LoadTest(args).run() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -15,7 +15,21 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from catalog import CATALOG
 from conference import ConferenceApi
+import facets
+import textsearch
+
+TASK_NAME_HEADER = 'X-AppEngine-TaskName'
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load the conference catalog of a new instance."""
+        CATALOG.load()
+        self.response.set_status(204)
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -24,6 +38,20 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class ReleaseSeatHoldsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Give the seats of expired holds back."""
+        ConferenceApi._releaseExpiredHolds()
+        self.response.set_status(204)
+
+
+class DeleteAppliedFacetDeltasHandler(webapp2.RequestHandler):
+    def get(self):
+        """Forget facet updates too old to be retried."""
+        facets.deleteExpiredAppliedDeltas()
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
@@ -45,8 +73,162 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organizer's display name to their conferences."""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('userId'), self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start storing organizer names on existing Conferences."""
+        taskqueue.add(url='/tasks/migrate_organizer_names')
+        self.response.set_status(202)
+
+    def post(self):
+        """Store the organizer names of a batch of Conferences."""
+        ConferenceApi._migrateOrganizerNames(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Profile registrations to Registration entities."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(202)
+
+    def post(self):
+        """Move the registrations of a batch of Profiles."""
+        ConferenceApi._migrateRegistrations(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateSpeakerSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Speaker session keys to SpeakerSession entities."""
+        taskqueue.add(url='/tasks/migrate_speaker_sessions')
+        self.response.set_status(202)
+
+    def post(self):
+        """Move the session keys of a batch of Speakers."""
+        ConferenceApi._migrateSpeakers(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateSessionTimesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start setting startDateTime on existing Sessions."""
+        taskqueue.add(url='/tasks/migrate_session_times')
+        self.response.set_status(202)
+
+    def post(self):
+        """Resave a batch of Sessions."""
+        ConferenceApi._migrateSessionTimes(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class PutSpeakerSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index new Sessions under their speakers."""
+        ConferenceApi._putSpeakerSessions(
+            self.request.get_all('websafeSessionKey'))
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Promote a batch of waiters to the seats left at a conference."""
+        ConferenceApi._promoteWaitlist(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class RegisterWaitersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Register a batch of promoted waiters."""
+        ConferenceApi._registerWaiters(
+            self.request.get('websafeConferenceKey'),
+            self.request.get_all('userId'))
+        self.response.set_status(204)
+
+
+class IndexDocumentHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the full-text search index of a Conference or Session."""
+        textsearch.indexDocument(ndb.Key(urlsafe=self.request.get('websafeKey')))
+        self.response.set_status(204)
+
+
+class RebuildSearchIndexHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-indexing every Conference and Session."""
+        taskqueue.add(url='/tasks/rebuild_search_index')
+        self.response.set_status(202)
+
+    def post(self):
+        """Re-index a batch of Conferences or Sessions."""
+        textsearch.rebuildIndex(self.request.get('kind') or None,
+                                self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class RebuildSessionDurationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start counting the duration of every Session again."""
+        facets.clearCounts((facets.DURATION_FIELD,))
+        taskqueue.add(url='/tasks/rebuild_session_durations')
+        self.response.set_status(202)
+
+    def post(self):
+        """Count the durations of a batch of Sessions."""
+        facets.rebuildDurationCounts(
+            self.request.get('cursor') or None,
+            self.request.headers.get(TASK_NAME_HEADER))
+        self.response.set_status(204)
+
+
+class UpdateFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply changes to the conference facet counts."""
+        facets.applyEncodedDeltas(self.request.get('deltas'),
+                                  self.request.headers.get(TASK_NAME_HEADER))
+        self.response.set_status(204)
+
+
+class RebuildConferenceFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start counting the facets of every Conference again."""
+        facets.clearCounts(facets.FACET_FIELDS)
+        taskqueue.add(url='/tasks/rebuild_conference_facets')
+        self.response.set_status(202)
+
+    def post(self):
+        """Count the facets of a batch of Conferences."""
+        facets.rebuildConferenceCounts(
+            self.request.get('cursor') or None,
+            self.request.headers.get(TASK_NAME_HEADER))
+        self.response.set_status(204)
+
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/release_seat_holds', ReleaseSeatHoldsHandler),
+    ('/crons/delete_applied_facet_deltas', DeleteAppliedFacetDeltasHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/migrate_organizer_names', MigrateOrganizerNamesHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/migrate_speaker_sessions', MigrateSpeakerSessionsHandler),
+    ('/tasks/migrate_session_times', MigrateSessionTimesHandler),
+    ('/tasks/put_speaker_sessions', PutSpeakerSessionsHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/register_waiters', RegisterWaitersHandler),
+    ('/tasks/index_document', IndexDocumentHandler),
+    ('/tasks/rebuild_search_index', RebuildSearchIndexHandler),
+    ('/tasks/update_facets', UpdateFacetsHandler),
+    ('/tasks/rebuild_conference_facets', RebuildConferenceFacetsHandler),
+    ('/tasks/rebuild_session_durations', RebuildSessionDurationsHandler),
 ], debug=True)
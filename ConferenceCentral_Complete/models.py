@@ -12,11 +12,14 @@ created/forked from conferences.py by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+from datetime import datetime
 import httplib
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
+import etags
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -26,14 +29,31 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True) # legacy, see Registration
     sessionKeysInWishlist = ndb.KeyProperty(kind='Session', repeated=True)
 
+class Registration(ndb.Model):
+    """Registration -- Profile (parent) registered for a Conference, keyed by
+    the websafe Conference key"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    created    = ndb.DateTimeProperty(auto_now_add=True)
+    fromWaitlist = ndb.BooleanProperty(default=False, indexed=False)
+
+class EmailIndex(ndb.Model):
+    """EmailIndex -- user id of an email address, keyed by the normalized
+    address"""
+    userId = ndb.StringProperty(indexed=False, required=True)
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
     teeShirtSize = messages.EnumField('TeeShirtSize', 2)
 
+class ProfileMiniForms(messages.Message):
+    """ProfileMiniForms -- multiple ProfileMiniForm outbound form message"""
+    items = messages.MessageField(ProfileMiniForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class ProfileForm(messages.Message):
     """ProfileForm -- Profile outbound form message"""
     displayName = messages.StringField(1)
@@ -42,6 +62,12 @@ class ProfileForm(messages.Message):
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionKeysInWishlist = messages.StringField(5, repeated=True)
 
+class ProfileCacheStatsForm(messages.Message):
+    """ProfileCacheStatsForm -- Profile cache hit and miss counts"""
+    requestHits = messages.IntegerField(1)
+    memcacheHits = messages.IntegerField(2)
+    misses = messages.IntegerField(3)
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
@@ -62,6 +88,45 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    lastModified    = ndb.DateTimeProperty(auto_now=True)
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        self.version += 1
+
+    def _post_put_hook(self, future):
+        etags.conferenceWritten(self.key)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- part of the seats still available at a Conference"""
+    conference = ndb.KeyProperty(kind='Conference')
+    seats      = ndb.IntegerProperty(default=0)
+
+class SeatHold(ndb.Model):
+    """SeatHold -- seat taken from a SeatShard (parent) for a user, keyed by
+    user id, until the registration is confirmed or the hold expires"""
+    conference = ndb.KeyProperty(kind='Conference', indexed=False)
+    expires    = ndb.DateTimeProperty()
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- user (by id) waiting for a seat at a Conference (parent)"""
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+class SeatHoldForm(messages.Message):
+    """SeatHoldForm -- seat held for the user until expires"""
+    websafeHoldKey          = messages.StringField(1)
+    websafeConferenceKey    = messages.StringField(2)
+    expires                 = messages.StringField(3)
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one shard of the Conference counts per value of a field"""
+    counts = ndb.JsonProperty()
+
+class AppliedFacetDeltas(ndb.Model):
+    """AppliedFacetDeltas -- count changes already added to the FacetShards,
+    keyed by the name of the task that added them"""
+    applied = ndb.DateTimeProperty(auto_now_add=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,10 +142,23 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class ConferenceCreateResultForm(messages.Message):
+    """ConferenceCreateResultForm -- outcome of creating one Conference"""
+    index       = messages.IntegerField(1)
+    conference  = messages.MessageField(ConferenceForm, 2)
+    error       = messages.StringField(3)
+
+class ConferenceCreateResultForms(messages.Message):
+    """ConferenceCreateResultForms -- outcomes of creating several Conferences"""
+    items = messages.MessageField(ConferenceCreateResultForm, 1, repeated=True)
 
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -91,6 +169,33 @@ class Session(ndb.Model):
     duration           = ndb.IntegerProperty()  # In minutes
     date               = ndb.DateProperty()
     startTime          = ndb.TimeProperty()
+    # date and startTime together, so a time window is one range scan
+    startDateTime      = ndb.DateTimeProperty()
+
+    def _pre_put_hook(self):
+        if self.date and self.startTime:
+            self.startDateTime = datetime.combine(self.date, self.startTime)
+        else:
+            self.startDateTime = None
+
+class ConferenceAgenda(ndb.Model):
+    """ConferenceAgenda -- all Sessions of the Conference (parent) as an
+    encoded SessionForms message"""
+    sessionForms = ndb.BlobProperty(compressed=True)
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of Conferences with a field value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- Conference counts per value of a field"""
+    field = messages.StringField(1)
+    counts = messages.MessageField(FacetCountForm, 2, repeated=True)
+
+class FacetForms(messages.Message):
+    """FacetForms -- Conference counts for all the facet fields"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
 
 class SessionForm(messages.Message):
     """Session -- Session form message"""
@@ -107,6 +212,9 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
 
 class Speaker(ndb.Model):
     """Speaker -- Speaker object"""
@@ -114,7 +222,14 @@ class Speaker(ndb.Model):
     organization    = ndb.StringProperty()
     email           = ndb.StringProperty()
     website         = ndb.StringProperty()
-    sessionKeys     = ndb.KeyProperty(kind='Session', repeated=True)
+    sessionKeys     = ndb.KeyProperty(kind='Session', repeated=True) # legacy, see SpeakerSession
+
+class SpeakerSession(ndb.Model):
+    """SpeakerSession -- Session of a Speaker (parent), keyed by the websafe
+    Session key"""
+    conference = ndb.KeyProperty(kind='Conference')
+    date       = ndb.DateProperty()
+    startTime  = ndb.TimeProperty()
 
 class SpeakerForm(messages.Message):
     """Speaker -- Speaker form message"""
@@ -155,11 +270,76 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- Session query inbound form message"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
 
 class SessionQueryDurationForm(messages.Message):
     """SessionQueryDuration - Session duration query inbound message"""
     minDuration = messages.IntegerField(1)
     maxDuration = messages.IntegerField(2)
+    limit       = messages.IntegerField(3)
+    pageToken   = messages.StringField(4)
+
+class SessionWindowForm(messages.Message):
+    """SessionWindowForm -- Sessions starting in a time window of one day
+    inbound message"""
+    date         = messages.StringField(1, required=True)  # YYYY-MM-DD
+    startTime    = messages.StringField(2)  # HH:MM, midnight if unset
+    endTime      = messages.StringField(3)  # HH:MM exclusive, end of day if unset
+    includeTypes = messages.StringField(4, repeated=True)
+    excludeTypes = messages.StringField(5, repeated=True)
+    pageSize     = messages.IntegerField(6)
+    pageToken    = messages.StringField(7)
+
+class DurationBucketForm(messages.Message):
+    """DurationBucketForm -- number of Sessions in a duration range"""
+    minDuration = messages.IntegerField(1)
+    maxDuration = messages.IntegerField(2)  # exclusive, unset for the last
+    count       = messages.IntegerField(3)
+
+class DurationHistogramForm(messages.Message):
+    """DurationHistogramForm -- Session counts per duration range"""
+    items           = messages.MessageField(DurationBucketForm, 1, repeated=True)
+    withoutDuration = messages.IntegerField(2)
+    total           = messages.IntegerField(3)
+
+class SearchForm(messages.Message):
+    """SearchForm -- full-text search inbound form message"""
+    query = messages.StringField(1)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- occurrences of a term in a searchable entity"""
+    kind       = ndb.StringProperty()
+    term       = ndb.StringProperty()
+    document   = ndb.KeyProperty(indexed=False)
+    frequency  = ndb.IntegerProperty(indexed=False)
+    length     = ndb.IntegerProperty(indexed=False)  # document length in terms
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- terms currently indexed for a searchable entity"""
+    kind       = ndb.StringProperty(indexed=False)
+    terms      = ndb.StringProperty(repeated=True, indexed=False)
+    length     = ndb.IntegerProperty(indexed=False)
+
+class SearchStats(ndb.Model):
+    """SearchStats -- one shard of the number and total length of indexed
+    entities of a kind"""
+    documents   = ndb.IntegerProperty(default=0, indexed=False)
+    totalLength = ndb.IntegerProperty(default=0, indexed=False)
 
 class SpeakerQueryOrganizationForm(messages.Message):
     """SpeakerQueryOrganizationForm -- Speaker organization query inbound message"""
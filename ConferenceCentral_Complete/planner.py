@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner
+
+The datastore only allows inequality filters on a single property per
+query. The planner pushes the equality filters and the most selective
+inequality down to the datastore and evaluates the remaining filters in
+memory while the query results are streamed in, stopping as soon as a
+page of matching entities has been collected.
+
+"""
+
+import operator
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+# in-memory equivalents of the datastore filter operators
+COMPARATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'IN': lambda value, values: value in values,
+}
+
+LOWER_BOUNDS = ('>', '>=')
+UPPER_BOUNDS = ('<', '<=')
+
+# most entities looked at for a single page when filtering in memory
+MAX_SCANNED = 1000
+
+
+class QueryPlan(object):
+    """QueryPlan -- datastore query plus the filters applied in memory"""
+
+    def __init__(self, query, inequality_field, residual):
+        self.query = query
+        self.inequality_field = inequality_field
+        self.residual = residual
+
+    def matches(self, entity):
+        """Return True if entity satisfies all the in-memory filters."""
+        for filtr in self.residual:
+            compare = comparator(filtr['operator'])
+            value = getattr(entity, filtr['field'], None)
+            # like the datastore, a repeated property matches when any
+            # one of its values does
+            if isinstance(value, (list, tuple)):
+                if not any(compare(v, filtr['value']) for v in value):
+                    return False
+            elif not compare(value, filtr['value']):
+                return False
+        return True
+
+
+def comparator(op):
+    """Return the in-memory comparison for op.
+
+    A missing value only matches '!='. Like the datastore, it doesn't
+    satisfy an equality or a range on a value, where Python 2 would
+    either rank None below every number or fail to compare it with dates
+    and times.
+    """
+    compare = COMPARATORS[op]
+    if op == '!=':
+        return compare
+    return lambda value, other: value is not None and compare(value, other)
+
+
+def pickInequality(filters):
+    """Return the inequality field expected to be the most selective.
+
+    A field bounded on both sides is preferred over an open range. '!='
+    and 'IN' are never pushed down as the datastore runs them as several
+    queries, which can't be resumed from a cursor.
+    """
+    bounds = {}
+    for filtr in filters:
+        if filtr['operator'] in LOWER_BOUNDS:
+            bounds.setdefault(filtr['field'], set()).add('lower')
+        elif filtr['operator'] in UPPER_BOUNDS:
+            bounds.setdefault(filtr['field'], set()).add('upper')
+    if not bounds:
+        return None
+    return sorted(bounds, key=lambda field: (-len(bounds[field]), field))[0]
+
+
+def planQuery(model, filters, order=None):
+    """Return a QueryPlan for filters on model.
+
+    filters is a list of dicts with 'field', 'operator' and 'value' keys,
+    using the operators in COMPARATORS. order is the name of the property
+    to sort on after the pushed down inequality, if any.
+    """
+    inequality_field = pickInequality(filters)
+
+    qry = model.query()
+    residual = []
+    for filtr in filters:
+        if filtr['operator'] == '=' or (
+                filtr['field'] == inequality_field and
+                filtr['operator'] in LOWER_BOUNDS + UPPER_BOUNDS):
+            qry = qry.filter(ndb.query.FilterNode(
+                filtr['field'], filtr['operator'], filtr['value']))
+        else:
+            residual.append(filtr)
+
+    # the datastore requires the inequality property to be sorted first
+    if inequality_field:
+        qry = qry.order(ndb.GenericProperty(inequality_field))
+    if order and order != inequality_field:
+        qry = qry.order(ndb.GenericProperty(order))
+    return QueryPlan(qry, inequality_field, residual)
+
+
+@ndb.tasklet
+def fetchPageAsync(qry, page_size=None, cursor=None, predicate=None,
+                   max_scanned=MAX_SCANNED):
+    """Run qry once, collecting a page of entities that satisfy predicate.
+
+    Returns a (results, next_cursor, more) tuple. Without a page_size the
+    whole query is read and no cursor is produced.
+    """
+    paged = page_size is not None
+    # without in-memory filters, one extra result tells us whether there
+    # is another page; with them we can't know how many we will skip
+    limit = None
+    if paged and predicate is None:
+        limit = page_size + 1
+    it = qry.iter(limit=limit, batch_size=limit or page_size,
+                  start_cursor=cursor, produce_cursors=paged)
+
+    results = []
+    scanned = 0
+    while (yield it.has_next_async()):
+        entity = it.next()
+        scanned += 1
+        if predicate is None or predicate(entity):
+            results.append(entity)
+            if paged and len(results) >= page_size:
+                break
+        # give up on filling the page rather than scanning too far; the
+        # client can carry on from the cursor
+        if paged and scanned >= max_scanned:
+            break
+
+    next_cursor, more = None, False
+    if paged:
+        more = it.probably_has_next()
+        try:
+            next_cursor = it.cursor_after()
+        except datastore_errors.BadArgumentError:
+            more = False
+    raise ndb.Return((results, next_cursor, more))
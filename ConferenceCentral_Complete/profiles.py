@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""profiles.py
+
+Udacity conference server-side Python App Engine Profile cache
+
+Nearly every endpoint starts by loading the user's Profile. Profiles are
+kept in a memo for the rest of the request and in memcache, stored with
+PROFILE_CACHE_VERSION so that entries written by an older layout of
+Profile are ignored. Writers drop the memcache entry once their
+transaction has committed, with a short lock against add() so that a
+reader that read the Profile before the commit can't put the old one
+back. Reads inside a transaction always go to the datastore.
+
+Hits and misses are counted per instance and added to shared counters in
+memcache every STATS_FLUSH_EVERY lookups.
+
+"""
+
+from collections import Counter
+import threading
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+# bump when Profile changes in a way old cached entities can't be read as
+PROFILE_CACHE_VERSION = 1
+MEMCACHE_PROFILE_TPL = 'profile:%s'
+PROFILE_CACHE_TIME = 3600
+# longer than a read of the Profile may take
+PROFILE_LOCK_TIME = 10  # seconds
+
+MEMCACHE_STATS_PREFIX = 'profileCacheStats:'
+STATS = ('requestHits', 'memcacheHits', 'misses')
+STATS_FLUSH_EVERY = 100
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _count(stat):
+    """Count a lookup, flushing the counts to memcache now and then."""
+    with _counts_lock:
+        _counts[stat] += 1
+        if sum(_counts.itervalues()) < STATS_FLUSH_EVERY:
+            return
+        counts = dict(_counts)
+        _counts.clear()
+    memcache.offset_multi(counts, key_prefix=MEMCACHE_STATS_PREFIX,
+                          initial_value=0)
+
+
+def getStats():
+    """Return the hit and miss counts of all instances as a dict."""
+    stats = memcache.get_multi(STATS, key_prefix=MEMCACHE_STATS_PREFIX)
+    with _counts_lock:
+        return dict((stat, stats.get(stat, 0) + _counts[stat]) for stat in STATS)
+
+
+def getProfile(user_id, memo):
+    """Return the Profile of user_id, or None if there is none yet.
+
+    memo is a dict of the Profiles read during the current request.
+    """
+    p_key = ndb.Key('Profile', user_id)
+    if ndb.in_transaction():
+        return p_key.get()
+
+    if user_id in memo:
+        _count('requestHits')
+        return memo[user_id]
+
+    cache_key = MEMCACHE_PROFILE_TPL % user_id
+    cached = memcache.get(cache_key)
+    if cached and cached[0] == PROFILE_CACHE_VERSION:
+        _count('memcacheHits')
+        profile = cached[1]
+    else:
+        _count('misses')
+        profile = p_key.get()
+        if profile:
+            memcache.add(cache_key, (PROFILE_CACHE_VERSION, profile),
+                         time=PROFILE_CACHE_TIME)
+
+    if profile:
+        memo[user_id] = profile
+    return profile
+
+
+def invalidate(user_id, memo=None):
+    """Drop the cached Profile of user_id once the current write commits."""
+    if memo is not None:
+        memo.pop(user_id, None)
+    ndb.get_context().call_on_commit(lambda: memcache.delete(
+        MEMCACHE_PROFILE_TPL % user_id, seconds=PROFILE_LOCK_TIME))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counters
+
+The seats still available at a conference are split over NUM_SHARDS
+SeatShard root entities, so concurrent registrations take seats from
+different entity groups instead of all rewriting the Conference entity.
+The number of seats available is the sum of the shards. Conferences
+created before the shards existed keep their count in
+Conference.seatsAvailable until their shards are created by
+loadShards().
+
+"""
+
+import random
+
+from google.appengine.ext import ndb
+
+from models import SeatHold
+from models import SeatShard
+
+NUM_SHARDS = 10
+
+
+def shardKeys(conf_key):
+    """Return the keys of the seat shards of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (wsck, i)) for i in range(NUM_SHARDS)]
+
+
+def holdKeys(conf_key, user_id):
+    """Return the keys a seat hold of a user may have, one per shard."""
+    return [ndb.Key(SeatHold, user_id, parent=shard_key)
+            for shard_key in shardKeys(conf_key)]
+
+
+def _split(seats):
+    """Return seats split as evenly as possible over NUM_SHARDS."""
+    seats = max(seats, 0)
+    return [seats // NUM_SHARDS + (1 if i < seats % NUM_SHARDS else 0)
+            for i in range(NUM_SHARDS)]
+
+
+def createShards(conf_key, seats):
+    """Return new (unsaved) shards holding seats for a conference."""
+    return [SeatShard(key=key, conference=conf_key, seats=count)
+            for key, count in zip(shardKeys(conf_key), _split(seats))]
+
+
+@ndb.transactional(xg=True)
+def _createMissingShards(conf):
+    """Create the shards of a conference from its seatsAvailable if missing."""
+    shards = ndb.get_multi(shardKeys(conf.key))
+    if not any(shards):
+        shards = createShards(conf.key, conf.seatsAvailable or 0)
+        ndb.put_multi(shards)
+    return shards
+
+
+def loadShards(conf):
+    """Return the seat shards of a conference, creating them if missing."""
+    shards = ndb.get_multi(shardKeys(conf.key))
+    if not any(shards):
+        shards = _createMissingShards(conf)
+    return shards
+
+
+def getSeatsAvailable(confs):
+    """Return the number of seats available at each of confs.
+
+    The shards of all the conferences are read with a single get_multi.
+    """
+    keys = [key for conf in confs for key in shardKeys(conf.key)]
+    shards = ndb.get_multi(keys)
+    counts = []
+    for i, conf in enumerate(confs):
+        conf_shards = [s for s in shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS] if s]
+        if conf_shards:
+            counts.append(sum(shard.seats for shard in conf_shards))
+        else:
+            counts.append(conf.seatsAvailable)
+    return counts
+
+
+def candidateShardKeys(shards):
+    """Return the keys of the shards with seats left, in random order.
+
+    shards are read outside of any transaction; the caller re-reads the
+    shard it picks in its transaction and moves on to the next one if it
+    has run out in the meantime.
+    """
+    keys = [shard.key for shard in shards if shard and shard.seats > 0]
+    random.shuffle(keys)
+    return keys
+
+
+@ndb.transactional()
+def returnSeats(conf_key, count):
+    """Give count seats back to a random shard of a conference."""
+    shard = random.choice(shardKeys(conf_key)).get()
+    shard.seats += count
+    shard.put()
+
+
+def takeSeats(shards, count):
+    """Take count seats from shards, fullest first.
+
+    Returns the shards that changed; the caller writes them in the
+    transaction they were read in.
+    """
+    changed = []
+    for shard in sorted(shards, key=lambda shard: -shard.seats):
+        if count <= 0:
+            break
+        taken = min(shard.seats, count)
+        if taken > 0:
+            shard.seats -= taken
+            count -= taken
+            changed.append(shard)
+    return changed
+
+
+def rebalance(conf, delta):
+    """Add delta seats to a conference and spread them evenly over its shards.
+
+    Must be called in a transaction; reads and writes all the shards, so
+    it is meant for organizer changes rather than registrations. Returns
+    the new number of seats available.
+    """
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf.key)) if shard]
+    if shards:
+        seats = sum(shard.seats for shard in shards)
+    else:
+        seats = conf.seatsAvailable or 0
+    seats = max(seats + delta, 0)
+    ndb.put_multi(createShards(conf.key, seats))
+    return seats
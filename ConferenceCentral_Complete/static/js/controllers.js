@@ -346,6 +346,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     $scope.pagination = $scope.pagination || {};
     $scope.pagination.currentPage = 0;
     $scope.pagination.pageSize = 20;
+    /**
+     * Holds the token returned by the server for fetching the next page of conferences.
+     * @type {string}
+     */
+    $scope.pagination.nextPageToken = null;
     /**
      * Returns the number of the pages in the pagination.
      *
@@ -379,6 +384,15 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         return angular.element(event.target).hasClass('disabled');
     }
 
+    /**
+     * Fetches the next page of conferences from the server, using the same filters.
+     */
+    $scope.pagination.loadNextPage = function () {
+        if ($scope.pagination.nextPageToken) {
+            $scope.queryConferencesAll($scope.pagination.nextPageToken);
+        }
+    }
+
     /**
      * Adds a filter and set the default value.
      */
@@ -414,6 +428,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.pagination.currentPage = 0;
+        $scope.pagination.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -423,22 +439,37 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the filters sent with the first page, reused when fetching the next pages.
+     * @type {Array}
+     */
+    $scope.sentFilters = [];
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param pageToken the token of the page to fetch; the first page is fetched if omitted.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
+        if (!pageToken) {
+            $scope.sentFilters = [];
+            for (var i = 0; i < $scope.filters.length; i++) {
+                var filter = $scope.filters[i];
+                if (filter.field && filter.operator && filter.value) {
+                    $scope.sentFilters.push({
+                        field: filter.field.enumValue,
+                        operator: filter.operator.enumValue,
+                        value: filter.value
+                    });
+                }
+            }
+        }
         var sendFilters = {
-            filters: []
+            filters: $scope.sentFilters,
+            pageSize: $scope.pagination.pageSize
         }
-        for (var i = 0; i < $scope.filters.length; i++) {
-            var filter = $scope.filters[i];
-            if (filter.field && filter.operator && filter.value) {
-                sendFilters.filters.push({
-                    field: filter.field.enumValue,
-                    operator: filter.operator.enumValue,
-                    value: filter.value
-                });
-            }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
         }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
@@ -458,10 +489,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (pageToken) {
+                            // Show the page that has just been fetched.
+                            $scope.pagination.currentPage = $scope.pagination.numberOfPages();
+                        } else {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.pagination.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+
+Udacity conference server-side Python App Engine full-text search
+
+Conferences and sessions are indexed in the datastore as an inverted index:
+one SearchPosting entity per (term, document) holding the term frequency
+and the document length, which is all BM25 ranking needs together with the
+per-kind totals kept in SearchStats. Documents are re-indexed from a task
+queued whenever they are written; SearchDocument remembers which terms a
+document was indexed under, so postings of dropped terms can be deleted.
+
+The totals of a kind are split over NUM_STATS_SHARDS SearchStats entities,
+and each document write only changes one randomly picked shard, so
+concurrent re-indexing tasks don't contend on a single entity.
+
+"""
+
+from collections import Counter
+import math
+import random
+import re
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+from models import SearchPosting
+from models import SearchStats
+
+# the text properties indexed for each kind
+SEARCH_FIELDS = {
+    'Conference': ('name', 'description'),
+    'Session': ('name', 'highlights'),
+}
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with',
+))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# most postings read per query term, in key order, so a term in more
+# documents only ranks the first MAX_POSTINGS of them; rarer terms are the
+# useful ones
+MAX_POSTINGS = 1000
+NUM_STATS_SHARDS = 20
+# documents re-indexed per task by rebuildIndex()
+REBUILD_BATCH_SIZE = 20
+# longer tokens are not indexed
+MAX_TERM_LENGTH = 64
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the list of index terms in text."""
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(text.lower())
+            if 1 < len(token) <= MAX_TERM_LENGTH and token not in STOP_WORDS]
+
+
+def documentTerms(entity):
+    """Return a Counter of the terms in the searchable fields of entity."""
+    terms = Counter()
+    for field in SEARCH_FIELDS[entity.key.kind()]:
+        value = getattr(entity, field, None)
+        for text in (value if isinstance(value, list) else [value]):
+            terms.update(tokenize(text))
+    return terms
+
+
+def _postingKey(term, doc_key):
+    return ndb.Key(SearchPosting, '%s|%s' % (term, doc_key.urlsafe()))
+
+
+def _statsKey(kind, index):
+    # shard 0 keeps the id of the single SearchStats of older versions
+    if not index:
+        return ndb.Key(SearchStats, kind)
+    return ndb.Key(SearchStats, '%s-%d' % (kind, index))
+
+
+@ndb.transactional(xg=True)
+def _saveDocument(doc_key, terms, length):
+    """Record the terms of a document and update the totals of its kind."""
+    kind = doc_key.kind()
+    doc = SearchDocument.get_by_id(doc_key.urlsafe())
+    stats_key = _statsKey(kind, random.randint(0, NUM_STATS_SHARDS - 1))
+    stats = stats_key.get() or SearchStats(key=stats_key)
+    if doc:
+        stats.documents -= 1
+        stats.totalLength -= doc.length
+    else:
+        doc = SearchDocument(id=doc_key.urlsafe(), kind=kind)
+    doc.terms = sorted(terms)
+    doc.length = length
+    stats.documents += 1
+    stats.totalLength += length
+    ndb.put_multi([doc, stats])
+
+
+def getStats(kind):
+    """Return the (documents, totalLength) totals of kind."""
+    shards = ndb.get_multi([_statsKey(kind, index)
+                            for index in range(NUM_STATS_SHARDS)])
+    return (sum(shard.documents for shard in shards if shard),
+            sum(shard.totalLength for shard in shards if shard))
+
+
+def indexDocument(doc_key):
+    """Bring the index entries of the entity with doc_key up to date.
+
+    Safe to run more than once for the same write, as task queue tasks may.
+    """
+    entity = doc_key.get()
+    if not entity:
+        return
+    terms = documentTerms(entity)
+    length = sum(terms.itervalues())
+
+    doc = SearchDocument.get_by_id(doc_key.urlsafe())
+    old_terms = set(doc.terms) if doc else set()
+
+    # every posting carries the document length, so all of them are
+    # rewritten; only the postings of dropped terms need deleting
+    ndb.put_multi([
+        SearchPosting(key=_postingKey(term, doc_key), kind=doc_key.kind(),
+                      term=term, document=doc_key, frequency=frequency,
+                      length=length)
+        for term, frequency in terms.iteritems()
+    ])
+    ndb.delete_multi([_postingKey(term, doc_key)
+                      for term in old_terms.difference(terms)])
+    _saveDocument(doc_key, terms.keys(), length)
+
+
+def rebuildIndex(kind=None, websafe_cursor=None):
+    """Re-index a batch of the searchable entities.
+
+    Queues a task for the next batch, going through the kinds of
+    SEARCH_FIELDS in turn, until every entity has been indexed. Indexing
+    is safe to repeat, so this brings in entities written before they were
+    indexed without counting the others twice.
+    """
+    kinds = sorted(SEARCH_FIELDS)
+    kind = kind or kinds[0]
+    cursor = Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+    keys, next_cursor, more = ndb.Query(kind=kind).fetch_page(
+        REBUILD_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+    for key in keys:
+        indexDocument(key)
+
+    if more and next_cursor:
+        taskqueue.add(params={'kind': kind, 'cursor': next_cursor.urlsafe()},
+                      url='/tasks/rebuild_search_index')
+    elif kinds.index(kind) + 1 < len(kinds):
+        taskqueue.add(params={'kind': kinds[kinds.index(kind) + 1]},
+                      url='/tasks/rebuild_search_index')
+
+
+def search(kind, text, page_size, offset=0):
+    """Return a page of keys of kind ranked by BM25 against text.
+
+    Returns a (keys, next_offset) tuple; next_offset is None on the last
+    page.
+    """
+    terms = sorted(set(tokenize(text)))
+    if not terms:
+        return [], None
+    documents, total_length = getStats(kind)
+    if not documents:
+        return [], None
+
+    # fetch the postings of all the terms in parallel
+    queries = [SearchPosting.query(SearchPosting.kind == kind,
+                                   SearchPosting.term == term)
+               for term in terms]
+    postings_lists = [future.get_result() for future in
+                      [qry.fetch_async(MAX_POSTINGS) for qry in queries]]
+    # a term found in more documents than were read is weighted by the
+    # number of documents it is really in
+    count_futures = [qry.count_async() if len(postings) == MAX_POSTINGS
+                     else None
+                     for qry, postings in zip(queries, postings_lists)]
+
+    total = float(documents)
+    average_length = total_length / total or 1.0
+    scores = {}
+    for postings, count_future in zip(postings_lists, count_futures):
+        df = count_future.get_result() if count_future else len(postings)
+        idf = math.log(1.0 + (total - df + 0.5) / (df + 0.5))
+        for posting in postings:
+            tf = posting.frequency
+            norm = K1 * (1.0 - B + B * posting.length / average_length)
+            scores[posting.document] = scores.get(posting.document, 0.0) + \
+                idf * tf * (K1 + 1.0) / (tf + norm)
+
+    ranked = sorted(scores, key=lambda key: (-scores[key], key.urlsafe()))
+    page = ranked[offset:offset + page_size]
+    next_offset = offset + page_size if offset + page_size < len(ranked) else None
+    return page, next_offset
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""tokens.py
+
+Udacity conference server-side Python App Engine OAuth token verification
+
+Verifies the bearer token of a request and returns the Google user id it
+was issued for. ID tokens are checked locally: their RS256 signature
+against Google's public keys, which are fetched rarely and cached for as
+long as the certs endpoint allows, and their issuer, audience and expiry.
+Access tokens, and ID tokens that can't be checked locally, are sent to
+the tokeninfo endpoint.
+
+Every verified token is cached, by its hash, in instance memory and in
+memcache until it expires, so that steady-state requests make no network
+calls at all. The tokeninfo and certs URLs are read from the environment
+(TOKENINFO_URL, OAUTH_CERTS_URL) so that a fake server can stand in for
+Google's; see fake_tokeninfo.py.
+
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+import endpoints
+
+from settings import WEB_CLIENT_ID
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+from settings import ANDROID_AUDIENCE
+
+try:
+    from Crypto.Hash import SHA256
+    from Crypto.PublicKey import RSA
+    from Crypto.Signature import PKCS1_v1_5
+except ImportError:
+    # without pycrypto every token goes to the tokeninfo endpoint
+    RSA = None
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+FETCH_DEADLINE = 5  # seconds
+FETCH_ATTEMPTS = 2
+
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+AUDIENCES = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID,
+             ANDROID_AUDIENCE, endpoints.API_EXPLORER_CLIENT_ID)
+CLOCK_SKEW = 300  # seconds
+
+MEMCACHE_TOKEN_TPL = 'oauthToken:%s'
+MEMCACHE_CERTS_KEY = 'oauthCerts'
+DEFAULT_CERTS_CACHE_TIME = 3600
+CERTS_REFETCH_TIME = 60  # seconds
+# how long to trust a tokeninfo answer that doesn't say when it expires
+DEFAULT_TOKEN_CACHE_TIME = 300
+MAX_CACHED_TOKENS = 10000
+
+# token hash -> (user_id, expires)
+_tokens = {}
+# {'keys': {kid: (n, e)}, 'fetched': time, 'expires': time}
+_certs = {}
+# kid -> RSA key built from _certs
+_rsa_keys = {}
+_lock = threading.Lock()
+
+
+def _tokeninfoUrl():
+    return os.environ.get('TOKENINFO_URL', TOKENINFO_URL)
+
+
+def _certsUrl():
+    return os.environ.get('OAUTH_CERTS_URL', CERTS_URL)
+
+
+def _b64decode(data):
+    """Decode unpadded base64url data."""
+    data = str(data)
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _fetch(url):
+    """GET url, retrying at once on server errors; return the response."""
+    resp = None
+    for attempt in range(FETCH_ATTEMPTS):
+        try:
+            resp = urlfetch.fetch(url, deadline=FETCH_DEADLINE)
+        except urlfetch.Error:
+            continue
+        if resp.status_code < 500:
+            break
+    return resp
+
+
+def _cacheToken(token_hash, user_id, expires):
+    """Remember a verified token in this instance and in memcache."""
+    now = time.time()
+    if expires <= now:
+        return
+    with _lock:
+        if len(_tokens) >= MAX_CACHED_TOKENS:
+            for key, (_, until) in _tokens.items():
+                if until <= now:
+                    del _tokens[key]
+            if len(_tokens) >= MAX_CACHED_TOKENS:
+                _tokens.clear()
+        _tokens[token_hash] = (user_id, expires)
+    memcache.set(MEMCACHE_TOKEN_TPL % token_hash, (user_id, expires),
+                 time=int(expires))
+
+
+def _getCachedToken(token_hash):
+    """Return the user id of a verified, unexpired token, or None."""
+    now = time.time()
+    cached = _tokens.get(token_hash)
+    if cached is None:
+        cached = memcache.get(MEMCACHE_TOKEN_TPL % token_hash)
+        if cached is None:
+            return None
+        with _lock:
+            _tokens[token_hash] = cached
+    user_id, expires = cached
+    if expires <= now:
+        return None
+    return user_id
+
+
+def _loadCerts():
+    """Fetch the public keys; return ({kid: (n, e)}, seconds to cache)."""
+    resp = _fetch(_certsUrl())
+    if resp is None or resp.status_code != 200:
+        return {}, 0
+    keys = {}
+    for jwk in json.loads(resp.content).get('keys', []):
+        if jwk.get('kty') == 'RSA' and 'kid' in jwk:
+            keys[jwk['kid']] = (
+                long(binascii.hexlify(_b64decode(jwk['n'])), 16),
+                long(binascii.hexlify(_b64decode(jwk['e'])), 16))
+    match = re.search(r'max-age=(\d+)',
+                      resp.headers.get('Cache-Control', ''))
+    return keys, int(match.group(1)) if match else DEFAULT_CERTS_CACHE_TIME
+
+
+def _getKey(kid):
+    """Return the RSA public key with id kid, or None if there is none.
+
+    The key set is refetched when it expires, and when a token names a key
+    that isn't in it (Google has rotated its keys), at most once every
+    CERTS_REFETCH_TIME.
+    """
+    now = time.time()
+    certs = _certs
+    if certs.get('expires', 0) <= now:
+        certs = memcache.get(MEMCACHE_CERTS_KEY) or {}
+    keys = certs.get('keys', {})
+    if certs.get('expires', 0) <= now or (
+            kid not in keys and
+            certs.get('fetched', 0) + CERTS_REFETCH_TIME <= now):
+        keys, cache_time = _loadCerts()
+        if keys:
+            certs = {'keys': keys, 'fetched': now, 'expires': now + cache_time}
+            memcache.set(MEMCACHE_CERTS_KEY, certs, time=cache_time)
+    if kid not in keys:
+        return None
+
+    with _lock:
+        if certs is not _certs:
+            _certs.clear()
+            _certs.update(certs)
+            _rsa_keys.clear()
+        key = _rsa_keys.get(kid)
+        if key is None:
+            key = _rsa_keys[kid] = RSA.construct(keys[kid])
+    return key
+
+
+def _verifyIdToken(token):
+    """Check an ID token locally.
+
+    Returns (user_id, expires) for a valid token, False for one that is
+    certainly invalid, and None if it can't be checked here.
+    """
+    if RSA is None:
+        return None
+    try:
+        header_b64, payload_b64, signature_b64 = str(token).split('.')
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if header.get('alg') != 'RS256':
+        return None
+    key = _getKey(header.get('kid'))
+    if key is None:
+        return None
+
+    digest = SHA256.new('%s.%s' % (header_b64, payload_b64))
+    if not PKCS1_v1_5.new(key).verify(digest, signature):
+        return False
+    now = time.time()
+    try:
+        expires = int(payload['exp'])
+        issued = int(payload.get('iat', now))
+    except (KeyError, ValueError, TypeError):
+        return False
+    if expires + CLOCK_SKEW <= now or issued - CLOCK_SKEW > now:
+        return False
+    if payload.get('iss') not in ISSUERS or \
+            payload.get('aud') not in AUDIENCES:
+        return False
+    if not payload.get('sub'):
+        return False
+    return payload['sub'], expires
+
+
+def _tokeninfo(token, token_type):
+    """Ask the tokeninfo endpoint about a token.
+
+    Returns (user_id, expires), or None if the token isn't valid. An ID
+    token the endpoint rejects is tried again as an access token.
+    """
+    token_types = [token_type]
+    if token_type == 'id_token':
+        token_types.append('access_token')
+    for token_type in token_types:
+        resp = _fetch('%s?%s=%s' % (_tokeninfoUrl(), token_type, token))
+        if resp is None:
+            return None
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            user_id = info.get('user_id') or info.get('sub')
+            if not user_id:
+                return None
+            if 'expires_in' in info:
+                expires = time.time() + int(info['expires_in'])
+            elif 'exp' in info:
+                expires = int(info['exp'])
+            else:
+                expires = time.time() + DEFAULT_TOKEN_CACHE_TIME
+            return user_id, expires
+        if resp.status_code != 400:
+            return None
+    return None
+
+
+def getTokenUserId(token, token_type='id_token'):
+    """Return the Google user id token was issued for, or '' if invalid."""
+    token_hash = hashlib.sha256(token).hexdigest()
+    user_id = _getCachedToken(token_hash)
+    if user_id is not None:
+        return user_id
+
+    verified = None
+    if token_type == 'id_token':
+        verified = _verifyIdToken(token)
+    if verified is None:
+        verified = _tokeninfo(token, token_type)
+    if not verified:
+        return ''
+    user_id, expires = verified
+    _cacheToken(token_hash, user_id, expires)
+    return user_id
@@ -1,10 +1,10 @@
-import json
 import os
-import time
+import threading
 import uuid
+from collections import OrderedDict
 
-from google.appengine.api import urlfetch
-from models import Profile
+from models import EmailIndex
+from tokens import getTokenUserId
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -17,29 +17,54 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return getTokenUserId(token, token_type)
 
     if id_type == "custom":
-        # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        # user ids are random, and stable once given to an email address
+        return _getEmailUserId(user.email())
+
+
+def normalizeEmail(email):
+    """Return the form of email that EmailIndex entities are keyed by."""
+    return email.strip().lower()
+
+
+class _LruCache(object):
+    """_LruCache -- thread-safe dict that keeps the size most recently used
+    items"""
+
+    def __init__(self, size):
+        self._size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+
+EMAIL_CACHE_SIZE = 10000
+# an email's user id never changes, so entries never go stale
+_email_user_ids = _LruCache(EMAIL_CACHE_SIZE)
+
+
+def _getEmailUserId(email):
+    """Return the user id of email, giving it a new one on first use."""
+    email = normalizeEmail(email)
+    user_id = _email_user_ids.get(email)
+    if user_id is None:
+        # a key get, or a transaction the first time an email is seen
+        user_id = EmailIndex.get_or_insert(
+            email, userId=uuid.uuid4().hex).userId
+        _email_user_ids.put(email, user_id)
+    return user_id